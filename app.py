@@ -20,7 +20,8 @@ from services.auth_service import AuthService
 from services.encryption_service import EncryptionService
 from services.capsule_service import CapsuleService
 from services.scheduler_service import SchedulerService
-from services.email_service import EmailService
+from services.email_service import get_email_service
+from utils.json_provider import ORJSONProvider
 
 # Load .env from project directory
 env_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env')
@@ -49,6 +50,7 @@ db = client[get_database_name()]
 
 def create_app():
     app = Flask(__name__)
+    app.json = ORJSONProvider(app)
     CORS(app)
     app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key')
     app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024
@@ -57,7 +59,7 @@ def create_app():
     auth_service = AuthService(db, JWT_SECRET)
     encryption_service = EncryptionService()
     capsule_service = CapsuleService(db, encryption_service)
-    email_service = EmailService()
+    email_service = get_email_service()
     # Pass Flask app to scheduler for proper context handling
     scheduler_service = SchedulerService(db, capsule_service, email_service, app=app)
     scheduler_service.start_scheduler()
@@ -7,7 +7,9 @@ import os
 from pymongo import MongoClient
 from bson import ObjectId
 from services.auth_service import AuthService, require_auth
-from services.email_service import EmailService
+from services.capsule_service import CapsuleService
+from services.encryption_service import EncryptionService
+from services.email_service import get_email_service
 from utils.validators import validate_email, validate_password, validate_display_name
 
 auth_bp = Blueprint('auth', __name__)
@@ -24,8 +26,22 @@ def get_db():
     return client['timecapsule']
 
 _db = get_db()
+_users = _db.get_collection('users')
 _auth_service = AuthService(_db, os.getenv('JWT_SECRET'))
-_email_service = EmailService()
+_email_service = get_email_service()
+_capsules = None
+
+
+def _get_capsules():
+    """Lazily create the CapsuleService used for account deletion.
+    
+    Deferred so the auth routes still load while encryption or storage
+    is not configured.
+    """
+    global _capsules
+    if _capsules is None:
+        _capsules = CapsuleService(_db, EncryptionService())
+    return _capsules
 
 
 @auth_bp.route('/auth/register', methods=['POST'])
@@ -54,7 +70,7 @@ def register():
             return jsonify({'error': name_error}), 400
 
         # Pre-check duplicate display name to return 409 semantics
-        if _db.get_collection('users').find_one({'display_name': display_name}):
+        if _users.find_one({'display_name': display_name}):
             return jsonify({'error': 'Display name already in use. Please choose another name.'}), 409
 
         user = _auth_service.create_user(email, password, display_name)
@@ -114,10 +130,13 @@ def update_profile():
             return jsonify({'error': name_error}), 400
         
         # Pre-check duplicate to set 409
-        if _db.get_collection('users').find_one({'display_name': display_name, '_id': {'$ne': ObjectId(user_id)}}):
+        if _users.find_one({'display_name': display_name, '_id': {'$ne': ObjectId(user_id)}}):
             return jsonify({'error': 'Display name already in use. Please choose another name.'}), 409
 
         updated_user = _auth_service.update_user(user_id, display_name)
+        
+        # Capsule metadata caches sender/recipient display names
+        CapsuleService.invalidate_user(user_id)
         return jsonify({
             'message': 'Profile updated successfully',
             'user': updated_user
@@ -161,23 +180,20 @@ def delete_account():
         user_id = request.user['uid']
         
         # Delete all user's capsules first
-        from services.capsule_service import CapsuleService
-        from services.encryption_service import EncryptionService
-        encryption = EncryptionService()
-        capsules = CapsuleService(_db, encryption)
+        capsules = _get_capsules()
         
         # Get all user capsules
         user_capsules = capsules.get_user_capsules(user_id, include_locked=True)
         
-        # Delete each capsule (including GridFS files)
-        for capsule in user_capsules:
-            try:
-                capsules.delete_capsule(capsule['capsule_id'], user_id)
-            except Exception:
-                pass  # Continue even if some deletions fail
+        # Delete the capsules the user sent (including stored files)
+        try:
+            capsules.delete_capsules([c['capsule_id'] for c in user_capsules], user_id)
+        except Exception:
+            pass  # Continue with the account deletion even if this fails
         
         # Delete user account
         success = _auth_service.delete_user(user_id)
+        CapsuleService.invalidate_user(user_id)
         
         if success:
             return jsonify({'message': 'Account deleted successfully'}), 200
@@ -223,14 +239,15 @@ def forgot_password():
         _auth_service.request_password_reset(email)
         
         # Get user to send email (if exists)
-        user_doc = _db.get_collection('users').find_one({'email': email.lower()})
+        user_doc = _users.find_one({'email': email.lower()})
         if user_doc:
             # Get reset token from user document
             reset_token = user_doc.get('password_reset_token')
             if reset_token:
                 # Send reset email
                 try:
-                    _email_service.send_password_reset_email(
+                    _email_service.send_in_background(
+                        _email_service.send_password_reset_email,
                         recipient_email=user_doc['email'],
                         recipient_name=user_doc.get('display_name'),
                         reset_token=reset_token
@@ -7,13 +7,12 @@ All capsule operations including creation, retrieval, update, delete, and unlock
 import os
 import traceback
 from datetime import datetime
-from flask import Blueprint, request, jsonify, send_file, current_app
+from flask import Blueprint, Response, request, jsonify, current_app
 from werkzeug.utils import secure_filename
-from io import BytesIO
 from services.auth_service import require_auth
 from services.encryption_service import EncryptionService
 from services.capsule_service import CapsuleService
-from services.email_service import EmailService
+from services.email_service import get_email_service
 from pymongo import MongoClient
 from bson import ObjectId
 from utils.validators import validate_unlock_date
@@ -31,9 +30,13 @@ def get_db():
     return client['timecapsule']
 
 _db = get_db()
+_users = _db.get_collection('users')
 _encryption = EncryptionService()
 _capsules = CapsuleService(_db, _encryption)
-_email_service = EmailService()
+_email_service = get_email_service()
+
+# Only the fields these routes read from user documents
+_USER_PROJECTION = {'email': 1, 'display_name': 1}
 
 
 @capsule_bp.route('/capsules', methods=['POST'])
@@ -87,7 +90,7 @@ def create_capsule():
                 recipient_obj_id = ObjectId(recipient_id)
             except Exception:
                 return jsonify({'error': 'Invalid recipient_id format'}), 400
-            recipient_doc = _db.get_collection('users').find_one({'_id': recipient_obj_id})
+            recipient_doc = _users.find_one({'_id': recipient_obj_id}, _USER_PROJECTION)
             if not recipient_doc:
                 return jsonify({'error': 'Recipient not found. User may have been deleted.'}), 404
             resolved_recipient_id = str(recipient_doc['_id'])
@@ -97,7 +100,7 @@ def create_capsule():
                 return jsonify({'error': 'You cannot send a capsule to yourself'}), 400
                 
         elif recipient_name:
-            recipient_doc = _db.get_collection('users').find_one({'display_name': recipient_name})
+            recipient_doc = _users.find_one({'display_name': recipient_name}, _USER_PROJECTION)
             if not recipient_doc:
                 return jsonify({'error': 'No user found with that display name'}), 404
             resolved_recipient_id = str(recipient_doc['_id'])
@@ -111,7 +114,7 @@ def create_capsule():
                 sender_obj_id = ObjectId(user_id) if isinstance(user_id, str) else user_id
             except Exception:
                 sender_obj_id = user_id
-            sender_doc = _db.get_collection('users').find_one({'_id': sender_obj_id})
+            sender_doc = _users.find_one({'_id': sender_obj_id}, _USER_PROJECTION)
             if sender_doc and sender_doc.get('email'):
                 if sender_doc['email'].lower() == recipient_email.lower():
                     return jsonify({'error': 'You cannot send a capsule to yourself'}), 400
@@ -124,7 +127,12 @@ def create_capsule():
         if 'file' in request.files:
             file = request.files['file']
             if file.filename and file.filename != '':
-                file_data = file.read()
+                # Hand over the upload stream itself so the file is encrypted
+                # and uploaded in chunks instead of being read into memory
+                file.stream.seek(0, os.SEEK_END)
+                if file.stream.tell():
+                    file.stream.seek(0)
+                    file_data = file.stream
                 filename = secure_filename(file.filename)
         
         # At least one of description or file must be provided
@@ -154,12 +162,13 @@ def create_capsule():
         
         try:
             # Get sender info
-            sender_doc = _db.get_collection('users').find_one({'_id': ObjectId(user_id)})
+            sender_doc = _users.find_one({'_id': ObjectId(user_id)}, _USER_PROJECTION)
             sender_name = sender_doc.get('display_name') if sender_doc else None
             
             # Send to registered user
             if recipient_doc and recipient_doc.get('email'):
-                _email_service.send_capsule_created_notification(
+                _email_service.send_in_background(
+                    _email_service.send_capsule_created_notification,
                     recipient_email=recipient_doc['email'],
                     recipient_name=recipient_doc.get('display_name'),
                     sender_name=sender_name,
@@ -167,7 +176,8 @@ def create_capsule():
                 )
             # Send to external recipient
             elif recipient_email:
-                _email_service.send_capsule_created_external_notification(
+                _email_service.send_in_background(
+                    _email_service.send_capsule_created_external_notification,
                     recipient_email=recipient_email,
                     sender_name=sender_name,
                     unlock_date=unlock_date,
@@ -193,6 +203,8 @@ def get_capsules():
     - include_locked (default: true): Include locked capsules
     - page (default: 1): Page number
     - limit (default: 20): Items per page (max: 100)
+    - cursor (optional): next_cursor from a previous response; switches to
+      keyset pagination, which skips the page/total counts
     """
     try:
         user_id = request.user['uid']
@@ -207,18 +219,38 @@ def get_capsules():
         
         include_locked = request.args.get('include_locked', 'true').lower() == 'true'
         
-        # Get capsules
+        cursor = request.args.get('cursor')
+        if cursor is not None:
+            try:
+                result = _capsules.list_user_capsules_page(
+                    user_id, cursor=cursor or None, limit=limit, include_locked=include_locked
+                )
+            except ValueError as ve:
+                return jsonify({'error': str(ve)}), 400
+            except Exception as svc_error:
+                current_app.logger.error(f"Failed to get capsules: {svc_error}")
+                return jsonify({'error': 'Failed to retrieve capsules'}), 500
+            
+            return jsonify({
+                'capsules': result['capsules'],
+                'count': len(result['capsules']),
+                'limit': limit,
+                'next_cursor': result['next_cursor'],
+                'has_next': result['next_cursor'] is not None
+            }), 200
+        
+        # Get the requested page of capsules
+        skip = (page - 1) * limit
         try:
-            all_items = _capsules.get_user_capsules(user_id, include_locked=include_locked)
+            total_count = _capsules.count_user_capsules(user_id, include_locked=include_locked)
+            paginated_items = _capsules.get_user_capsules(
+                user_id, include_locked=include_locked, skip=skip, limit=limit
+            )
         except Exception as svc_error:
             current_app.logger.error(f"Failed to get capsules: {svc_error}")
             return jsonify({'error': 'Failed to retrieve capsules'}), 500
         
-        # Paginate
-        total_count = len(all_items)
         total_pages = (total_count + limit - 1) // limit if total_count > 0 else 0
-        skip = (page - 1) * limit
-        paginated_items = all_items[skip:skip + limit]
         
         return jsonify({
             'capsules': paginated_items,
@@ -333,13 +365,14 @@ def unlock_capsule(capsule_id):
                 
                 # Send email
                 if recipient_email:
-                    _email_service.send_capsule_unlocked_notification(
+                    _email_service.send_in_background(
+                        _email_service.send_capsule_unlocked_notification,
                         recipient_email=recipient_email,
                         recipient_name=recipient_name,
                         sender_name=sender_name,
                         unlock_date=unlock_date,
                     )
-                    current_app.logger.info(f"Unlock notification email sent to {recipient_email}")
+                    current_app.logger.info(f"Unlock notification email queued for {recipient_email}")
             except Exception as email_error:
                 current_app.logger.error(f"Failed to send unlock email: {email_error}")
         
@@ -410,7 +443,9 @@ def update_capsule(capsule_id):
         if unlock_date and old_unlock_date and old_unlock_date != unlock_date:
             try:
                 # Get capsule info for email
-                capsule_doc = _db.capsules.find_one({'capsule_id': capsule_id})
+                capsule_doc = _db.capsules.find_one(
+                    {'capsule_id': capsule_id}, {'recipient_email': 1, 'recipient_id': 1}
+                )
                 recipient_email = capsule_doc.get('recipient_email')
                 recipient_id = capsule_doc.get('recipient_id')
                 
@@ -432,14 +467,15 @@ def update_capsule(capsule_id):
                     current_app.logger.info(f"DEBUG: Sending email to {recipient_email}, old={old_unlock_date}, new={unlock_date}")
                     
                     # Send email notification
-                    _email_service.send_capsule_date_updated_notification(
+                    _email_service.send_in_background(
+                        _email_service.send_capsule_date_updated_notification,
                         recipient_email=recipient_email,
                         recipient_name=recipient_name,
                         sender_name=sender_name,
                         old_unlock_date=old_unlock_date,
                         new_unlock_date=unlock_date
                     )
-                    current_app.logger.info(f"Date update notification sent for capsule {capsule_id}")
+                    current_app.logger.info(f"Date update notification queued for capsule {capsule_id}")
                 else:
                     current_app.logger.warning(f"No recipient_email found for capsule {capsule_id}, skipping email")
             except Exception as email_error:
@@ -592,9 +628,9 @@ def download_capsule(capsule_id):
         if not is_owner and doc.get('recipient_id') != user_id:
             return jsonify({'error': 'Capsule not found'}), 404
         
-        # Get decrypted file data (allow owner to download locked capsules)
+        # Get decrypted file chunks (allow owner to download locked capsules)
         try:
-            file_data, filename, content_type = _capsules.get_decrypted_file_data(
+            file_chunks, filename, content_type = _capsules.iter_decrypted_file_data(
                 capsule_id,
                 allow_locked_for_owner=is_owner,
                 user_id=user_id
@@ -605,16 +641,13 @@ def download_capsule(capsule_id):
             current_app.logger.error(f"Failed to decrypt capsule {capsule_id}: {svc_error}")
             return jsonify({'error': 'Failed to decrypt capsule'}), 500
         
-        # Create file-like object from bytes
-        file_obj = BytesIO(file_data)
-        file_obj.seek(0)
-        
-        return send_file(
-            file_obj,
-            mimetype=content_type,
-            as_attachment=True,
-            download_name=filename
-        )
+        # The file was authenticated in full above; stream it from the spool
+        response = Response(file_chunks, mimetype=content_type)
+        response.headers.set('Content-Disposition', 'attachment', filename=filename)
+        # Lets clients tell a download cut short by a mid-stream error from a complete one
+        if doc.get('original_size') is not None:
+            response.content_length = doc['original_size']
+        return response
         
     except Exception as e:
         current_app.logger.exception("Unexpected error in download_capsule")
@@ -660,10 +693,10 @@ def debug_services():
 def debug_test_create():
     """Debug endpoint to test encryption."""
     try:
-        enc = EncryptionService()
         test_data = b"Hello World"
-        encrypted = enc.encrypt_data(test_data)
-        decrypted = enc.decrypt_data(encrypted['encrypted_data'], encrypted['iv'])
+        # Same raw-bytes path capsules use for storage
+        encrypted, iv = _encryption.encrypt_raw(test_data)
+        decrypted = _encryption.decrypt_raw(encrypted, iv)
         
         return jsonify({
             'status': 'ok',
@@ -2,7 +2,7 @@
 Dashboard Routes (MongoDB)
 """
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from services.auth_service import require_auth
 from services.encryption_service import EncryptionService
 from services.capsule_service import CapsuleService
@@ -176,7 +176,5 @@ def get_dashboard_stats():
             'type_breakdown': type_counts
         }), 200
     except Exception as e:
-        import traceback
-        print(f"Error in get_dashboard_stats: {str(e)}")
-        print(traceback.format_exc())
+        current_app.logger.exception(f"Error in get_dashboard_stats: {str(e)}")
         return jsonify({'error': str(e)}), 500
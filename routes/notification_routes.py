@@ -5,6 +5,7 @@ Notification Routes - in-app notifications (no email)
 from flask import Blueprint, request, jsonify
 from services.auth_service import require_auth
 from pymongo import MongoClient
+from bson import ObjectId
 import os
 from datetime import datetime, timedelta
 
@@ -22,6 +23,7 @@ def get_db():
 
 
 _db = get_db()
+_notifications = _db.get_collection('notifications')
 
 
 @notifications_bp.route('/notifications', methods=['GET'])
@@ -41,7 +43,7 @@ def list_notifications():
         query['created_at'] = {'$gte': start, '$lt': end}
 
     results = []
-    for doc in _db.get_collection('notifications').find(query).sort('created_at', -1):
+    for doc in _notifications.find(query).sort('created_at', -1):
         item = {
             'id': str(doc['_id']),
             'user_id': doc['user_id'],
@@ -61,9 +63,8 @@ def list_notifications():
 @require_auth
 def mark_notification_read(notification_id):
     """Mark a notification as read."""
-    from bson import ObjectId
     user_id = request.user['uid']
-    result = _db.get_collection('notifications').update_one(
+    result = _notifications.update_one(
         {'_id': ObjectId(notification_id), 'user_id': user_id},
         {'$set': {'read': True, 'read_at': datetime.utcnow()}}
     )
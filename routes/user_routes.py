@@ -23,6 +23,7 @@ def get_db():
 
 
 _db = get_db()
+_users = _db.get_collection('users')
 
 
 @user_bp.route('/users/search', methods=['GET'])
@@ -48,7 +49,7 @@ def search_users():
     }
 
     results = []
-    for doc in _db.get_collection('users').find(query).limit(10):
+    for doc in _users.find(query).limit(10):
         results.append({
             'uid': str(doc['_id']),
             'email': doc.get('email'),
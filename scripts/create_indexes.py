@@ -118,24 +118,49 @@ def create_indexes():
         print(f"  ⚠️  Compound index may already exist: {e}")
     
     try:
+        # Supersedes the (user_id, created_at) index, a prefix of this one
+        if 'user_id_created_at_idx' in capsules.index_information():
+            capsules.drop_index('user_id_created_at_idx')
         capsules.create_index(
-            [('user_id', 1), ('created_at', -1)],
-            name='user_id_created_at_idx'
+            [('user_id', 1), ('created_at', -1), ('_id', -1)],
+            name='user_id_created_at_id_idx'
         )
-        print("  ✅ Created compound index on ('user_id', 'created_at')")
+        print("  ✅ Created compound index on ('user_id', 'created_at', '_id')")
     except Exception as e:
         print(f"  ⚠️  Compound index may already exist: {e}")
-    
+
     try:
-        # For scheduler queries
+        # Second branch of the get_user_capsules $or query, so both branches
+        # can be served by index scans merged on created_at. _id is the
+        # keyset-pagination tie-breaker for capsules with equal created_at.
+        # Supersedes the (recipient_id, created_at) index
+        if 'recipient_id_created_at_idx' in capsules.index_information():
+            capsules.drop_index('recipient_id_created_at_idx')
         capsules.create_index(
-            [('is_unlocked', 1), ('unlock_date', 1)],
-            name='scheduler_query_idx'
+            [('recipient_id', 1), ('created_at', -1), ('_id', -1)],
+            name='recipient_id_created_at_id_idx'
         )
-        print("  ✅ Created compound index for scheduler queries")
+        print("  ✅ Created compound index on ('recipient_id', 'created_at', '_id')")
     except Exception as e:
         print(f"  ⚠️  Compound index may already exist: {e}")
-    
+
+    try:
+        # Partial index covering only locked capsules; it stays small as
+        # unlocked capsules accumulate, and matches the scheduler's
+        # {'is_unlocked': False, 'unlock_date': {'$lte': now}} query. It
+        # replaces the full (is_unlocked, unlock_date) index, which served
+        # the same query but was maintained on every capsule write
+        if 'scheduler_query_idx' in capsules.index_information():
+            capsules.drop_index('scheduler_query_idx')
+        capsules.create_index(
+            [('unlock_date', 1)],
+            partialFilterExpression={'is_unlocked': False},
+            name='locked_unlock_date_idx'
+        )
+        print("  ✅ Created partial index on 'unlock_date' for locked capsules")
+    except Exception as e:
+        print(f"  ⚠️  Partial index may already exist: {e}")
+
     print("\n" + "=" * 50)
     print("✅ Index creation completed!")
     print("\n📊 Index Summary:")
@@ -154,12 +179,33 @@ def create_indexes():
     notifications = db.get_collection('notifications')
     try:
         notifications.create_index('user_id', name='notif_user_id_idx')
-        notifications.create_index('created_at', name='notif_created_at_idx')
         notifications.create_index('read', name='notif_read_idx')
         print("  ✅ Created indexes on notifications")
     except Exception as e:
         print(f"  ⚠️  Notifications indexes may already exist: {e}")
 
+    try:
+        # Notifications expire after 90 days; the TTL index replaces the
+        # plain created_at index, which can't coexist on the same key
+        if 'notif_created_at_idx' in notifications.index_information():
+            notifications.drop_index('notif_created_at_idx')
+        notifications.create_index(
+            'created_at', expireAfterSeconds=90 * 24 * 60 * 60, name='notif_created_at_ttl'
+        )
+        print("  ✅ Created TTL index on 'created_at' (90 days)")
+    except Exception as e:
+        print(f"  ⚠️  Index on 'created_at' may already exist: {e}")
+
+    # Scheduler leases
+    print("\n⏰ Creating indexes for 'scheduler_locks' collection...")
+    scheduler_locks = db.get_collection('scheduler_locks')
+    try:
+        # Expired hourly leases are removed by MongoDB's TTL monitor
+        scheduler_locks.create_index('expires_at', expireAfterSeconds=0, name='expires_at_ttl')
+        print("  ✅ Created TTL index on 'expires_at'")
+    except Exception as e:
+        print(f"  ⚠️  Index on 'expires_at' may already exist: {e}")
+
 if __name__ == '__main__':
     try:
         create_indexes()
@@ -3,12 +3,13 @@ Authentication Service using MongoDB, bcrypt, and JWT
 """
 
 import os
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from functools import wraps
 from flask import request, jsonify
 from bson import ObjectId
 import bcrypt
 import jwt
+from utils.helpers import utcnow
 
 
 class AuthService:
@@ -36,12 +37,13 @@ class AuthService:
                 raise Exception('Display name already in use')
 
         hashed = self.hash_password(password)
+        now = utcnow()
         user_doc = {
             'email': email.lower(),
             'password': hashed,
             'display_name': display_name,
-            'created_at': datetime.utcnow(),
-            'updated_at': datetime.utcnow(),
+            'created_at': now,
+            'updated_at': now,
         }
         result = self.users.insert_one(user_doc)
         return {
@@ -54,7 +56,7 @@ class AuthService:
         payload = {
             'uid': uid,
             'email': email,
-            'exp': datetime.utcnow() + timedelta(days=7)
+            'exp': utcnow() + timedelta(days=7)
         }
         return jwt.encode(payload, self.jwt_secret, algorithm='HS256')
 
@@ -89,7 +91,7 @@ class AuthService:
 
     def update_user(self, uid: str, display_name: str = None) -> dict:
         """Update user profile information."""
-        update_data = {'updated_at': datetime.utcnow()}
+        update_data = {'updated_at': utcnow()}
         if display_name is not None:
             # Check uniqueness for display_name if changed
             if self.users.find_one({'display_name': display_name, '_id': {'$ne': ObjectId(uid)}}):
@@ -118,7 +120,7 @@ class AuthService:
         new_hashed = self.hash_password(new_password)
         result = self.users.update_one(
             {'_id': ObjectId(uid)},
-            {'$set': {'password': new_hashed, 'updated_at': datetime.utcnow()}}
+            {'$set': {'password': new_hashed, 'updated_at': utcnow()}}
         )
         
         if result.modified_count == 0:
@@ -156,12 +158,13 @@ class AuthService:
             return True
         
         # Generate reset token (expires in 24 hours)
+        now = utcnow()
         reset_token = jwt.encode(
             {
                 'uid': str(user['_id']),
                 'email': user['email'],
                 'type': 'password_reset',
-                'exp': datetime.utcnow() + timedelta(hours=24)
+                'exp': now + timedelta(hours=24)
             },
             self.jwt_secret,
             algorithm='HS256'
@@ -172,8 +175,8 @@ class AuthService:
             {'_id': user['_id']},
             {'$set': {
                 'password_reset_token': reset_token,
-                'password_reset_expires': datetime.utcnow() + timedelta(hours=24),
-                'updated_at': datetime.utcnow()
+                'password_reset_expires': now + timedelta(hours=24),
+                'updated_at': now
             }}
         )
         
@@ -189,8 +192,8 @@ class AuthService:
             uid = decoded['uid']
             
             # Check expiration
-            exp = datetime.utcfromtimestamp(decoded['exp'])
-            if exp < datetime.utcnow():
+            exp = datetime.fromtimestamp(decoded['exp'], timezone.utc).replace(tzinfo=None)
+            if exp < utcnow():
                 raise Exception('Reset token has expired')
             
             # Update password and clear reset token
@@ -201,7 +204,7 @@ class AuthService:
                     'password': new_hashed,
                     'password_reset_token': None,
                     'password_reset_expires': None,
-                    'updated_at': datetime.utcnow()
+                    'updated_at': utcnow()
                 }}
             )
             
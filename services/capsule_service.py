@@ -8,15 +8,241 @@ NEW CAPSULES: All files are stored in Cloudinary ONLY.
 
 import os
 import uuid
-import base64
+import zlib
+import time
+import queue
 import logging
+import threading
+import tempfile
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from bson import ObjectId
-from gridfs import GridFS
+from types import MappingProxyType
+from typing import BinaryIO
+from bson import Binary, ObjectId
+from gridfs import GridFSBucket
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
 from werkzeug.utils import secure_filename
+from utils.helpers import b64encode_str, lazy_pool, utcnow
 
 logger = logging.getLogger(__name__)
 
+# Static lookup tables, built once at import
+_EXT_TO_TYPE = MappingProxyType({
+    'txt': 'text', 'pdf': 'text',
+    'png': 'image', 'jpg': 'image', 'jpeg': 'image', 'gif': 'image',
+    'mp4': 'video', 'avi': 'video', 'mov': 'video',
+    'mp3': 'audio', 'wav': 'audio', 'ogg': 'audio', 'm4a': 'audio', 'aac': 'audio', 'flac': 'audio'
+})
+
+_ALLOWED_EXTENSIONS = frozenset(_EXT_TO_TYPE)
+
+_CONTENT_TYPES = MappingProxyType({
+    'txt': 'text/plain', 'pdf': 'application/pdf',
+    'png': 'image/png', 'jpg': 'image/jpeg', 'jpeg': 'image/jpeg', 'gif': 'image/gif',
+    'mp4': 'video/mp4', 'avi': 'video/x-msvideo', 'mov': 'video/quicktime',
+    'mp3': 'audio/mpeg', 'wav': 'audio/wav', 'ogg': 'audio/ogg',
+    'm4a': 'audio/mp4', 'aac': 'audio/aac', 'flac': 'audio/flac'
+})
+
+# Description-only capsules below this size keep their ciphertext inline in
+# the capsule document instead of uploading a separate file
+_INLINE_MAX_SIZE = 900_000
+
+# Upper bound on concurrent storage requests issued for one bulk operation
+_STORAGE_WORKERS = 8
+
+# Cloudinary's delete_resources accepts at most this many public_ids per call
+_CLOUDINARY_DELETE_BATCH = 100
+
+# Plain-text content is deflated before encryption; other types are either
+# already compressed or too large to be worth the CPU. Streamed uploads are
+# only read into memory for this when they are small
+_COMPRESSIBLE_EXTENSIONS = frozenset({'txt'})
+_COMPRESS_MAX_STREAM_SIZE = 8 * 1024 * 1024
+_COMPRESSION_LEVEL = 6
+
+# Plaintext is read from uploaded file streams in chunks of this size
+_STREAM_CHUNK_SIZE = 1024 * 1024
+
+# Downloads are decrypted in full, and their tag checked, before any byte is
+# sent; plaintext up to this size is spooled in memory, the rest on disk
+_DOWNLOAD_SPOOL_MEMORY = 8 * 1024 * 1024
+
+# Chunk size for any file written through the GridFS bucket
+_GRIDFS_CHUNK_SIZE = 1024 * 1024
+
+# Encrypted chunks buffered ahead of a streamed upload: one upload request's
+# worth, so the next request's data is encrypted while the current one is sent
+_PIPELINE_DEPTH = 20
+
+
+_iso = datetime.isoformat
+
+# Only the fields _serialize_capsule reads are sent back for listings, so
+# server-only fields and anything added to capsule documents later are
+# never transferred or decoded
+_LISTING_PROJECTION = MappingProxyType(dict.fromkeys((
+    'capsule_id', 'user_id', 'sender_id', 'recipient_id', 'recipient_email',
+    'filename', 'capsule_type', 'description', 'original_size',
+    'unlock_date', 'created_at', 'unlocked_at', 'is_unlocked', 'status',
+    'storage_type', 'cloudinary_public_id', 'cloudinary_url',
+), 1))
+
+# Fields needed to locate (and delete) a capsule's stored file
+_STORAGE_PROJECTION = MappingProxyType(dict.fromkeys((
+    'capsule_id', 'storage_type', 'cloudinary_public_id', 'gridfs_id',
+), 1))
+
+# Fields a file replacement reads from the capsule it is replacing
+_REPLACE_PROJECTION = MappingProxyType({**_STORAGE_PROJECTION, 'filename': 1, 'unlock_date': 1})
+
+# unlock_capsule re-reads and retries this many times when the capsule is
+# edited between its read and its unlock write, then gives up
+_UNLOCK_ATTEMPTS = 3
+
+# Cursor batch size for listings that aren't paginated
+_LISTING_BATCH_SIZE = 500
+
+# Unlocked capsule documents are cached briefly, shared by every service
+# instance in the process; other processes (and direct collection writes)
+# can be up to this many seconds stale. The budget is in bytes, counting
+# inline ciphertext plus a nominal size per document
+_DOC_CACHE_TTL = 30
+_DOC_CACHE_BYTES = 32 * 1024 * 1024
+_DOC_CACHE_OVERHEAD = 1024
+
+# Decrypted payloads are cached by capsule_id and IV, bounded by total bytes,
+# so repeated unlocks, previews and downloads skip the fetch and decrypt
+_PLAINTEXT_CACHE_TTL = 300
+_PLAINTEXT_CACHE_BYTES = 64 * 1024 * 1024
+
+# Sender/recipient display info shown with capsule metadata
+_USER_CACHE_TTL = 300
+_USER_CACHE_SIZE = 10_000
+_USER_PROJECTION = MappingProxyType({'display_name': 1, 'email': 1})
+
+# Cached in place of a document for capsule_ids known not to exist. IDs are
+# random UUIDs, and creating a capsule drops any such entry for its ID
+_MISSING = object()
+
+
+# Removes stored files in the background once no capsule points at them.
+# Deletes block on network I/O, so they get their own pool rather than
+# sharing the CPU-sized decrypt pool
+_get_cleanup_pool = lazy_pool(_STORAGE_WORKERS, 'storage-cleanup')
+
+
+_PIPELINE_END = object()
+
+
+def _pipelined(chunks, depth: int = _PIPELINE_DEPTH):
+    """Yield from `chunks` while a background thread produces up to `depth` ahead.
+    
+    Exceptions raised while producing are re-raised to the consumer. If the
+    consumer stops early, the producer stops at its next chunk.
+    """
+    buffer = queue.Queue(maxsize=depth)
+    stopped = threading.Event()
+    
+    def put(item):
+        while not stopped.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+    
+    def produce():
+        try:
+            for chunk in chunks:
+                if not put(chunk):
+                    return
+            put(_PIPELINE_END)
+        except Exception as e:
+            put(e)
+    
+    producer = threading.Thread(target=produce, name='capsule-pipeline', daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is _PIPELINE_END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stopped.set()
+        producer.join()
+
+
+class _TTLCache:
+    """Small thread-safe LRU cache with per-entry expiry.
+    
+    Capacity is counted in entries, or in the units returned by `weigh`
+    when one is given; values heavier than the whole capacity are not cached.
+    """
+    
+    def __init__(self, maxsize: int, ttl: float, weigh=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._weigh = weigh or (lambda value: 1)
+        self._weight = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, weight, value = entry
+            if expires_at < time.monotonic():
+                self._pop(key)
+                return None
+            self._data.move_to_end(key)
+            return value
+    
+    def set(self, key, value):
+        weight = self._weigh(value)
+        with self._lock:
+            self._pop(key)
+            if weight > self.maxsize:
+                return
+            self._data[key] = (time.monotonic() + self.ttl, weight, value)
+            self._weight += weight
+            while self._weight > self.maxsize:
+                self._pop(next(iter(self._data)))
+    
+    def invalidate(self, key):
+        with self._lock:
+            self._pop(key)
+    
+    def _pop(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self._weight -= entry[1]
+
+# Shared by every CapsuleService in the process so a profile update made
+# through any of them (or through invalidate_user) is seen by all
+_user_cache = _TTLCache(_USER_CACHE_SIZE, _USER_CACHE_TTL)
+
+
+def _doc_weight(doc) -> int:
+    """Approximate a cached capsule document's size in bytes."""
+    if doc is _MISSING:
+        return _DOC_CACHE_OVERHEAD
+    return _DOC_CACHE_OVERHEAD + len(doc.get('ciphertext') or b'')
+
+
+# Also shared process-wide, so an unlock or delete through one instance
+# (e.g. the scheduler's) doesn't leave the others serving stale copies
+_doc_cache = _TTLCache(_DOC_CACHE_BYTES, _DOC_CACHE_TTL, weigh=_doc_weight)
+
 
 class CapsuleService:
     """Service for managing time capsules with Cloudinary storage ONLY."""
@@ -25,10 +251,11 @@ class CapsuleService:
         self.db = db
         self.encryption_service = encryption_service
         self.capsules = db.get_collection('capsules')
-        self.allowed_extensions = {
-            'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif', 
-            'mp4', 'avi', 'mov', 'mp3', 'wav', 'ogg', 'm4a', 'aac', 'flac'
-        }
+        self.users = db.get_collection('users')
+        self._plaintext_cache = _TTLCache(
+            _PLAINTEXT_CACHE_BYTES, _PLAINTEXT_CACHE_TTL, weigh=lambda entry: len(entry[1])
+        )
+        self.allowed_extensions = _ALLOWED_EXTENSIONS
         
         # Initialize Cloudinary storage (PRIMARY)
         self.cloudinary_storage = None
@@ -40,8 +267,8 @@ class CapsuleService:
         logger.info(f"Cloudinary config check: cloud_name={cloudinary_config['cloud_name'] is not None}, api_key={cloudinary_config['api_key'] is not None}, api_secret={cloudinary_config['api_secret'] is not None}")
         
         try:
-            from services.cloudinary_service import CloudinaryStorageService
-            self.cloudinary_storage = CloudinaryStorageService()
+            from services.cloudinary_service import get_cloudinary_storage
+            self.cloudinary_storage = get_cloudinary_storage()
             logger.info("✅ Cloudinary storage initialized successfully")
         except ImportError as e:
             logger.warning(f"⚠️ Cloudinary library not installed: {e}")
@@ -50,7 +277,6 @@ class CapsuleService:
             logger.warning(f"⚠️ Cloudinary not configured: {e}")
             self.cloudinary_storage = None
         except Exception as e:
-            import traceback
             logger.error(f"❌ Failed to initialize Cloudinary: {e}")
             logger.error(f"Cloudinary init traceback: {traceback.format_exc()}")
             self.cloudinary_storage = None
@@ -59,7 +285,7 @@ class CapsuleService:
         # NEW CAPSULES: All files go to Cloudinary only
         self.fs = None
         try:
-            self.fs = GridFS(db)
+            self.fs = GridFSBucket(db, chunk_size_bytes=_GRIDFS_CHUNK_SIZE)
             logger.info("GridFS initialized for backward compatibility with old capsules")
         except ImportError:
             logger.warning("⚠️ gridfs module not available")
@@ -70,27 +296,39 @@ class CapsuleService:
         if self.cloudinary_storage is None and self.fs is None:
             raise RuntimeError("No storage backend available")
     
+    def _load_capsule(self, capsule_id: str) -> dict | None:
+        """Fetch a capsule document by capsule_id, using the short-lived cache.
+        
+        Unlocking is one-way, so only unlocked documents are cached; locked
+        ones are always read fresh, so an unlock is seen immediately.
+        The returned document is shared with the cache and must not be mutated.
+        """
+        doc = _doc_cache.get(capsule_id)
+        if doc is None:
+            doc = self.capsules.find_one({'capsule_id': capsule_id})
+            # Misses are cached too, so repeated lookups of unknown IDs
+            # (scanners, stale links) don't each cost a round trip
+            if doc is None:
+                _doc_cache.set(capsule_id, _MISSING)
+            elif doc.get('is_unlocked'):
+                _doc_cache.set(capsule_id, doc)
+        return None if doc is _MISSING else doc
+
+    def _get_extension(self, filename):
+        """Get the lowercased extension of a filename, or '' if it has none."""
+        if not filename:
+            return ''
+        # One scan from the right; no separate membership test or list
+        _, dot, extension = filename.rpartition('.')
+        return extension.lower() if dot else ''
+
     def _allowed_file(self, filename):
         """Check if file extension is allowed."""
-        if not filename or '.' not in filename:
-            return False
-        return filename.rsplit('.', 1)[1].lower() in self.allowed_extensions
+        return self._get_extension(filename) in _EXT_TO_TYPE
 
     def _get_file_type(self, filename):
         """Get the file type category from filename."""
-        if not filename or '.' not in filename:
-            return 'other'
-        
-        extension = filename.rsplit('.', 1)[1].lower()
-        if extension in {'txt', 'pdf'}:
-            return 'text'
-        if extension in {'png', 'jpg', 'jpeg', 'gif'}:
-            return 'image'
-        if extension in {'mp4', 'avi', 'mov'}:
-            return 'video'
-        if extension in {'mp3', 'wav', 'ogg', 'm4a', 'aac', 'flac'}:
-            return 'audio'
-        return 'other'
+        return _EXT_TO_TYPE.get(self._get_extension(filename), 'other')
     
     def _safe_objectid(self, id_value):
         """Safely convert a string to ObjectId, handling errors gracefully."""
@@ -105,37 +343,130 @@ class CapsuleService:
                 return id_value
         return id_value
     
-    def _store_file(self, encrypted_bytes: bytes, capsule_id: str, content_type: str = 'application/octet-stream') -> dict:
+    def _storage_info(self, doc: dict) -> dict:
+        """Build the storage info used to read or delete a capsule's encrypted content.
+        
+        gridfs_id is normalised to an ObjectId here, once, so the storage
+        helpers can use it directly. Only API responses stringify it.
+        """
+        return {
+            'storage_type': doc.get('storage_type', 'cloudinary'),
+            'public_id': doc.get('cloudinary_public_id'),
+            'url': doc.get('cloudinary_url'),
+            'gridfs_id': self._safe_objectid(doc.get('gridfs_id')),
+            'ciphertext': doc.get('ciphertext')
+        }
+    
+    def _store_file(self, encrypted_bytes: bytes, capsule_id: str, content_type: str = 'application/octet-stream',
+                    name: str = None) -> dict:
         """Store encrypted file - Cloudinary ONLY for NEW capsules.
         
         NEW CAPSULES: All files MUST be stored in Cloudinary.
         GridFS is NOT used for new uploads.
         """
-        print(f"\n=== STORAGE DEBUG: capsule_id={capsule_id} ===")
-        print(f"Cloudinary storage available: {self.cloudinary_storage is not None}")
-        
         if not self.cloudinary_storage:
             raise ValueError("❌ Cloudinary storage is not available. Please configure Cloudinary credentials.")
         
-        print(f"Uploading to Cloudinary...")
         try:
             result = self.cloudinary_storage.upload_encrypted_file(
-                encrypted_bytes, capsule_id, content_type
+                encrypted_bytes, capsule_id, content_type, name=name
             )
-            print(f"✅ SUCCESS: Uploaded to Cloudinary: {result.get('public_id')}")
-            print(f"URL: {result.get('secure_url')}")
-            print("=== END STORAGE DEBUG ===\n")
+            logger.debug("Stored capsule %s in Cloudinary: %s", capsule_id, result.get('public_id'))
             return result
         except Exception as e:
-            print(f"❌ FAILED: Cloudinary upload failed: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.error(f"Cloudinary upload failed for capsule {capsule_id}: {e}")
+            raise ValueError(f"Failed to upload file to Cloudinary: {str(e)}")
+    
+    def _store_stream(self, encrypted_chunks, size: int, capsule_id: str) -> dict:
+        """Store encrypted file chunks in Cloudinary without buffering the whole file."""
+        if not self.cloudinary_storage:
+            raise ValueError("❌ Cloudinary storage is not available. Please configure Cloudinary credentials.")
+        
+        try:
+            # Encrypt on a background thread so it overlaps with the upload
+            return self.cloudinary_storage.upload_encrypted_stream(
+                _pipelined(encrypted_chunks), size, capsule_id
+            )
+        except Exception as e:
+            logger.error(f"Cloudinary stream upload failed for capsule {capsule_id}: {e}")
             raise ValueError(f"Failed to upload file to Cloudinary: {str(e)}")
     
+    def _compress(self, data: bytes) -> tuple:
+        """Deflate data if that makes it smaller.
+        
+        Returns:
+            tuple: (data, compression) where compression is 'zlib' or None
+        """
+        compressed = zlib.compress(data, _COMPRESSION_LEVEL)
+        if len(compressed) < len(data):
+            return compressed, 'zlib'
+        return data, None
+    
+    def _decompress(self, data: bytes, compression: str | None) -> bytes:
+        """Undo _compress for a capsule's decrypted content."""
+        if compression is None:
+            return data
+        if compression == 'zlib':
+            return zlib.decompress(data)
+        raise ValueError(f"Unsupported compression: {compression}")
+    
+    def _decompress_stream(self, chunks, compression: str | None):
+        """Undo _compress chunk by chunk."""
+        if compression is None:
+            return chunks
+        if compression != 'zlib':
+            raise ValueError(f"Unsupported compression: {compression}")
+        
+        def generate():
+            decompressor = zlib.decompressobj()
+            for chunk in chunks:
+                data = decompressor.decompress(chunk)
+                if data:
+                    yield data
+            yield decompressor.flush()
+        
+        return generate()
+    
+    def _spool(self, chunks):
+        """Consume `chunks` into a temporary file and return a generator over it.
+        
+        Any error raised while producing the chunks surfaces here, before
+        the caller has seen any data. The file is closed once the generator
+        is exhausted or closed.
+        """
+        spool = tempfile.SpooledTemporaryFile(max_size=_DOWNLOAD_SPOOL_MEMORY)
+        try:
+            for chunk in chunks:
+                spool.write(chunk)
+            spool.seek(0)
+        except BaseException:
+            spool.close()
+            raise
+        
+        def generate():
+            with spool:
+                while chunk := spool.read(_STREAM_CHUNK_SIZE):
+                    yield chunk
+        
+        return generate()
+    
+    def _stream_size(self, stream) -> int:
+        """Number of bytes left to read in a seekable binary stream."""
+        start = stream.tell()
+        end = stream.seek(0, os.SEEK_END)
+        stream.seek(start)
+        return end - start
+    
     def _retrieve_file(self, storage_info: dict) -> bytes:
         """Retrieve encrypted file from Cloudinary OR GridFS (for backward compatibility)."""
         storage_type = storage_info.get('storage_type', 'gridfs')
         
+        if storage_type == 'inline':
+            ciphertext = storage_info.get('ciphertext')
+            if ciphertext is None:
+                raise ValueError("Inline ciphertext missing from capsule")
+            return ciphertext
+        
         if storage_type == 'cloudinary':
             public_id = storage_info.get('public_id')
             if not public_id:
@@ -144,7 +475,7 @@ class CapsuleService:
             if not self.cloudinary_storage:
                 raise ValueError("Cloudinary storage not available")
             
-            return self.cloudinary_storage.get_encrypted_file(public_id)
+            return self.cloudinary_storage.get_encrypted_file(public_id, storage_info.get('url'))
         
         # Legacy GridFS support (for backward compatibility with old capsules)
         # NEW CAPSULES: Always use Cloudinary
@@ -152,21 +483,59 @@ class CapsuleService:
         if not grid_id:
             raise ValueError("Storage info missing: no public_id (Cloudinary) or gridfs_id (GridFS)")
         
-        grid_oid = self._safe_objectid(grid_id)
-        
-        if not isinstance(grid_oid, ObjectId):
+        if not isinstance(grid_id, ObjectId):
             raise ValueError(f"Invalid GridFS ID format: {grid_id}")
         
         try:
-            data_bytes = self.fs.get(grid_oid).read()
+            data_bytes = self.fs.open_download_stream(grid_id).read()
             return data_bytes
         except Exception as e:
             raise ValueError(f"Failed to retrieve file from GridFS: {str(e)}")
     
+    def _iter_file(self, storage_info: dict):
+        """Return an iterator over the encrypted file's chunks.
+        
+        Cloudinary and GridFS files are streamed chunk by chunk; inline
+        content is returned as a single chunk.
+        """
+        storage_type = storage_info.get('storage_type', 'gridfs')
+        
+        if storage_type == 'inline':
+            return iter((self._retrieve_file(storage_info),))
+        
+        if storage_type == 'cloudinary':
+            public_id = storage_info.get('public_id')
+            if not public_id:
+                raise ValueError("Cloudinary public_id missing from storage info")
+            
+            if not self.cloudinary_storage:
+                raise ValueError("Cloudinary storage not available")
+            
+            return self.cloudinary_storage.iter_encrypted_file(
+                public_id, _STREAM_CHUNK_SIZE, storage_info.get('url')
+            )
+        
+        grid_id = storage_info.get('gridfs_id')
+        if not grid_id:
+            raise ValueError("Storage info missing: no public_id (Cloudinary) or gridfs_id (GridFS)")
+        
+        if not isinstance(grid_id, ObjectId):
+            raise ValueError(f"Invalid GridFS ID format: {grid_id}")
+        
+        try:
+            # The download stream yields one stored chunk at a time
+            return iter(self.fs.open_download_stream(grid_id))
+        except Exception as e:
+            raise ValueError(f"Failed to retrieve file from GridFS: {str(e)}")
+    
     def _delete_file(self, storage_info: dict) -> bool:
         """Delete file from Cloudinary OR GridFS (for backward compatibility with old capsules)."""
         storage_type = storage_info.get('storage_type', 'gridfs')
         
+        if storage_type == 'inline':
+            # Ciphertext lives in the capsule document itself
+            return True
+        
         if storage_type == 'cloudinary':
             public_id = storage_info.get('public_id')
             if not public_id:
@@ -185,27 +554,225 @@ class CapsuleService:
             logger.warning("Cannot delete GridFS file: gridfs_id missing")
             return False
         
-        grid_oid = self._safe_objectid(grid_id)
-        
-        if not isinstance(grid_oid, ObjectId):
+        if not isinstance(grid_id, ObjectId):
             logger.warning(f"Invalid GridFS ID format: {grid_id}")
             return False
         
         try:
-            self.fs.delete(grid_oid)
+            self.fs.delete(grid_id)
             logger.info(f"Deleted file from GridFS: {grid_id}")
             return True
         except Exception as e:
             logger.error(f"Failed to delete GridFS file: {e}")
             return False
 
+    def _delete_file_later(self, storage_info: dict, capsule_id: str):
+        """Delete a stored file in the background; failures are only logged.
+        
+        Only for files no capsule document points at any more, so nothing
+        can read them while the delete is pending.
+        """
+        if storage_info.get('storage_type') == 'inline':
+            return
+        
+        def delete():
+            try:
+                self._delete_file(storage_info)
+            except Exception as e:
+                logger.warning(f"Could not delete file for capsule {capsule_id}: {e}")
+        
+        _get_cleanup_pool().submit(delete)
+    
+    def _delete_files_bulk(self, storage_infos: list) -> int:
+        """Delete several stored files concurrently; returns how many were deleted.
+        
+        Cloudinary files are removed up to _CLOUDINARY_DELETE_BATCH per
+        request, falling back to one request per file if a batch fails.
+        """
+        def delete(storage_info):
+            try:
+                return self._delete_file(storage_info)
+            except Exception as e:
+                logger.warning(f"Could not delete stored file {storage_info.get('public_id')}: {e}")
+                return False
+        
+        def delete_batch(batch):
+            try:
+                return len(self.cloudinary_storage.delete_files([info['public_id'] for info in batch]))
+            except Exception as e:
+                logger.warning(f"Batch delete of {len(batch)} Cloudinary files failed, deleting one by one: {e}")
+                return sum(map(delete, batch))
+        
+        if not storage_infos:
+            return 0
+        
+        cloudinary_infos = []
+        other_infos = []
+        for info in storage_infos:
+            if self.cloudinary_storage and info.get('storage_type') == 'cloudinary' and info.get('public_id'):
+                cloudinary_infos.append(info)
+            else:
+                other_infos.append(info)
+        
+        batches = [
+            cloudinary_infos[i:i + _CLOUDINARY_DELETE_BATCH]
+            for i in range(0, len(cloudinary_infos), _CLOUDINARY_DELETE_BATCH)
+        ]
+        
+        tasks = len(batches) + len(other_infos)
+        with ThreadPoolExecutor(max_workers=min(_STORAGE_WORKERS, tasks)) as pool:
+            deleted = pool.map(delete_batch, batches)
+            deleted_others = pool.map(delete, other_infos)
+            return sum(deleted) + sum(deleted_others)
+
+    def _validate_capsule_input(self, unlock_date, description, recipient_id, file_data, filename, recipient_email):
+        """Validate capsule creation input, raising ValueError on problems."""
+        # Validate recipient
+        if not recipient_id and not recipient_email:
+            raise ValueError("Recipient is required. Provide recipient_id or recipient_email.")
+        
+        # Validate content (file OR description)
+        if not file_data and not description:
+            raise ValueError("Either a file or description must be provided.")
+        
+        # Validate file if provided
+        if file_data and not filename:
+            raise ValueError("Filename is required when uploading a file.")
+        
+        if filename and not self._allowed_file(filename):
+            raise ValueError(f"File type not allowed: {filename}. Allowed: {', '.join(self.allowed_extensions)}")
+        
+        # Validate unlock_date type
+        if not isinstance(unlock_date, datetime):
+            raise ValueError("unlock_date must be a datetime object")
+
+    def _prepare_capsule(
+        self,
+        user_id,
+        unlock_date,
+        description: str | None = None,
+        recipient_id: str | None = None,
+        file_data: bytes | BinaryIO | None = None,
+        filename: str | None = None,
+        recipient_email: str | None = None,
+    ) -> dict:
+        """Encrypt and store a capsule's content and build its metadata document.
+        
+        Input must already have passed _validate_capsule_input. Nothing is
+        written to the capsules collection.
+        """
+        # ========== ENCRYPTION ==========
+        
+        capsule_id = str(uuid.uuid4())
+        
+        compression = None
+        if file_data and filename:
+            # File-based capsule
+            capsule_type = self._get_file_type(filename)
+            
+            compressible = self._get_extension(filename) in _COMPRESSIBLE_EXTENSIONS
+            if (compressible and hasattr(file_data, 'read')
+                    and self._stream_size(file_data) <= _COMPRESS_MAX_STREAM_SIZE):
+                file_data = file_data.read()
+            
+            if hasattr(file_data, 'read'):
+                # Uploaded file stream: encrypt lazily while it is being stored
+                original_size = self._stream_size(file_data)
+                encrypted_bytes = None
+                encrypted_chunks, iv = self.encryption_service.encrypt_stream(
+                    iter(lambda: file_data.read(_STREAM_CHUNK_SIZE), b'')
+                )
+            else:
+                original_size = len(file_data)
+                if compressible:
+                    file_data, compression = self._compress(file_data)
+                
+                # Encrypt file
+                encrypted_bytes, iv = self.encryption_service.encrypt_raw(file_data)
+            
+        elif description:
+            # Description-only capsule
+            capsule_type = 'text'
+            description_bytes = description.encode('utf-8')
+            original_size = len(description_bytes)
+            description_bytes, compression = self._compress(description_bytes)
+            
+            # Encrypt description
+            encrypted_bytes, iv = self.encryption_service.encrypt_raw(description_bytes)
+            filename = 'description.txt'
+        else:
+            raise ValueError("Invalid capsule content")
+        
+        # ========== STORAGE ==========
+        
+        ciphertext = None
+        if not file_data and len(encrypted_bytes) < _INLINE_MAX_SIZE:
+            # Small text capsules are stored inline; no upload round-trip
+            storage_info = {}
+            storage_type = 'inline'
+            ciphertext = Binary(encrypted_bytes)
+        else:
+            try:
+                if encrypted_bytes is None:
+                    storage_info = self._store_stream(
+                        encrypted_chunks,
+                        self.encryption_service.encrypted_size(original_size),
+                        capsule_id
+                    )
+                else:
+                    storage_info = self._store_file(
+                        encrypted_bytes, 
+                        capsule_id, 
+                        content_type='text/plain' if capsule_type == 'text' else 'application/octet-stream'
+                    )
+                storage_type = storage_info.get('storage_type', 'cloudinary')
+            except Exception as storage_error:
+                logger.error(f"Storage error for capsule {capsule_id}: {storage_error}")
+                raise ValueError(f"Failed to store capsule: {str(storage_error)}")
+        
+        return {
+            'capsule_id': capsule_id,
+            'user_id': user_id,
+            'sender_id': user_id,
+            'recipient_id': recipient_id,
+            'recipient_email': recipient_email,
+            'filename': filename,
+            'capsule_type': capsule_type,
+            'unlock_date': unlock_date,
+            'storage_type': storage_type,
+            'cloudinary_public_id': storage_info.get('public_id'),
+            'cloudinary_url': storage_info.get('secure_url'),
+            'gridfs_id': None,  # GridFS no longer used - all files go to Cloudinary
+            'ciphertext': ciphertext,
+            'encryption_iv': iv,
+            'compression': compression,
+            'original_size': original_size,
+            'description': description,
+            'created_at': utcnow(),
+            'is_unlocked': False,
+            'unlocked_at': None,
+            'status': 'locked'
+        }
+
+    def _created_result(self, doc: dict) -> dict:
+        """Build the API response for a newly created capsule document."""
+        is_cloudinary = doc['storage_type'] == 'cloudinary'
+        return {
+            'capsule_id': doc['capsule_id'],
+            'message': 'Capsule created successfully',
+            'unlock_date': doc['unlock_date'].isoformat(),
+            'storage_type': doc['storage_type'],
+            'cloudinary_public_id': doc['cloudinary_public_id'] if is_cloudinary else None,
+            'cloudinary_url': doc['cloudinary_url'] if is_cloudinary else None
+        }
+
     def create_capsule(
         self,
         user_id,
         unlock_date,
         description: str | None = None,
         recipient_id: str | None = None,
-        file_data: bytes | None = None,
+        file_data: bytes | BinaryIO | None = None,
         filename: str | None = None,
         recipient_email: str | None = None,
     ) -> dict:
@@ -217,7 +784,8 @@ class CapsuleService:
             unlock_date: datetime when the capsule should unlock
             description: Optional text description
             recipient_id: Optional registered recipient's user ID
-            file_data: Optional file bytes
+            file_data: Optional file bytes, or a seekable binary stream to
+                encrypt and upload in chunks
             filename: Optional filename (required if file_data provided)
             recipient_email: Optional external recipient email
             
@@ -228,112 +796,32 @@ class CapsuleService:
             ValueError: For validation errors (will be caught by route)
             Exception: For storage/encryption errors
         """
-        print(f"\n=== CREATE CAPSULE DEBUG ===")
-        print(f"user_id: {user_id}")
-        print(f"file_data provided: {file_data is not None}")
-        print(f"filename: {filename}")
-        print(f"Cloudinary storage available: {self.cloudinary_storage is not None}")
+        logger.debug(
+            "Creating capsule for user %s: file=%s filename=%s",
+            user_id, file_data is not None, filename
+        )
         try:
             # ========== VALIDATION ==========
             
-            # Validate recipient
-            if not recipient_id and not recipient_email:
-                raise ValueError("Recipient is required. Provide recipient_id or recipient_email.")
-            
-            # Validate content (file OR description)
-            if not file_data and not description:
-                raise ValueError("Either a file or description must be provided.")
-            
-            # Validate file if provided
-            if file_data and not filename:
-                raise ValueError("Filename is required when uploading a file.")
-            
-            if filename and not self._allowed_file(filename):
-                raise ValueError(f"File type not allowed: {filename}. Allowed: {', '.join(self.allowed_extensions)}")
-            
-            # Validate unlock_date type
-            if not isinstance(unlock_date, datetime):
-                raise ValueError("unlock_date must be a datetime object")
-            
-            # ========== ENCRYPTION ==========
-            
-            capsule_id = str(uuid.uuid4())
-            
-            if file_data and filename:
-                # File-based capsule
-                capsule_type = self._get_file_type(filename)
-                original_size = len(file_data)
-                
-                # Encrypt file
-                encrypted_result = self.encryption_service.encrypt_data(file_data)
-                encrypted_b64 = encrypted_result['encrypted_data']
-                iv = encrypted_result['iv']
-                
-            elif description:
-                # Description-only capsule
-                capsule_type = 'text'
-                description_bytes = description.encode('utf-8')
-                original_size = len(description_bytes)
-                
-                # Encrypt description
-                encrypted_result = self.encryption_service.encrypt_data(description_bytes)
-                encrypted_b64 = encrypted_result['encrypted_data']
-                iv = encrypted_result['iv']
-                filename = 'description.txt'
-            else:
-                raise ValueError("Invalid capsule content")
-            
-            # ========== STORAGE ==========
+            self._validate_capsule_input(
+                unlock_date, description, recipient_id, file_data, filename, recipient_email
+            )
             
-            encrypted_bytes = base64.b64decode(encrypted_b64)
+            # ========== ENCRYPTION + STORAGE ==========
             
-            try:
-                storage_info = self._store_file(
-                    encrypted_bytes, 
-                    capsule_id, 
-                    content_type='text/plain' if capsule_type == 'text' else 'application/octet-stream'
-                )
-                storage_type = storage_info.get('storage_type', 'cloudinary')
-            except Exception as storage_error:
-                logger.error(f"Storage error for capsule {capsule_id}: {storage_error}")
-                raise ValueError(f"Failed to store capsule: {str(storage_error)}")
+            doc = self._prepare_capsule(
+                user_id, unlock_date, description, recipient_id, file_data, filename, recipient_email
+            )
             
             # ========== DATABASE ==========
             
-            doc = {
-                'capsule_id': capsule_id,
-                'user_id': user_id,
-                'sender_id': user_id,
-                'recipient_id': recipient_id,
-                'recipient_email': recipient_email,
-                'filename': filename,
-                'capsule_type': capsule_type,
-                'unlock_date': unlock_date,
-                'storage_type': storage_type,
-                'cloudinary_public_id': storage_info.get('public_id'),
-                'cloudinary_url': storage_info.get('secure_url'),
-                'gridfs_id': None,  # GridFS no longer used - all files go to Cloudinary
-                'encryption_iv': iv,
-                'original_size': original_size,
-                'description': description,
-                'created_at': datetime.utcnow(),
-                'is_unlocked': False,
-                'unlocked_at': None,
-                'status': 'locked'
-            }
-            
             self.capsules.insert_one(doc)
+            # Drop any miss another instance cached for this ID
+            _doc_cache.invalidate(doc['capsule_id'])
             
-            logger.info(f"Capsule {capsule_id} created successfully by user {user_id}")
+            logger.info(f"Capsule {doc['capsule_id']} created successfully by user {user_id}")
             
-            return {
-                'capsule_id': capsule_id,
-                'message': 'Capsule created successfully',
-                'unlock_date': unlock_date.isoformat(),
-                'storage_type': storage_type,
-                'cloudinary_public_id': storage_info.get('public_id') if storage_type == 'cloudinary' else None,
-                'cloudinary_url': storage_info.get('secure_url') if storage_type == 'cloudinary' else None
-            }
+            return self._created_result(doc)
             
         except ValueError:
             # Re-raise validation errors
@@ -342,155 +830,412 @@ class CapsuleService:
             logger.error(f"Failed to create capsule: {e}")
             raise Exception(f"Capsule creation failed: {str(e)}")
 
-    def get_user_capsules(self, user_id, include_locked: bool = True) -> list:
-        """Get all capsules for a user."""
+    def create_capsules_bulk(self, user_id, capsules: list, max_workers: int = 4) -> list:
+        """
+        Create several capsules for one sender with a single metadata write.
+        
+        Every capsule is validated before anything is uploaded. Encryption
+        and uploads then run on a thread pool, and all metadata documents are
+        written with one unordered bulk_write of capsule_id-keyed upserts.
+        
+        Args:
+            user_id: The sender's user ID
+            capsules: List of dicts with the keyword arguments of create_capsule
+                (unlock_date, description, recipient_id, file_data, filename,
+                recipient_email)
+            max_workers: Maximum number of concurrent encrypt/upload workers
+            
+        Returns:
+            list of dicts in the same shape as create_capsule's result
+            
+        Raises:
+            ValueError: For validation or storage errors
+            Exception: For database errors
+        """
+        if not capsules:
+            return []
+        
+        for spec in capsules:
+            self._validate_capsule_input(
+                spec.get('unlock_date'), spec.get('description'), spec.get('recipient_id'),
+                spec.get('file_data'), spec.get('filename'), spec.get('recipient_email')
+            )
+        
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(self._prepare_capsule, user_id, **spec) for spec in capsules]
+        
+        docs = []
+        errors = []
+        for future in futures:
+            try:
+                docs.append(future.result())
+            except Exception as e:
+                errors.append(e)
+        
+        if errors:
+            # Don't leave orphaned uploads behind for a batch that won't be saved
+            self._delete_files_bulk([self._storage_info(doc) for doc in docs])
+            raise ValueError(f"Failed to create capsules: {str(errors[0])}")
+        
+        # Upserts keyed on capsule_id make re-sending the batch (e.g. after a
+        # dropped connection) a no-op for documents that were already written;
+        # pymongo splits the operations into server-sized batches
+        requests = [
+            UpdateOne({'capsule_id': doc['capsule_id']}, {'$setOnInsert': doc}, upsert=True)
+            for doc in docs
+        ]
         try:
-            # Include both sent and received capsules
-            or_clause = [{'user_id': user_id}, {'recipient_id': user_id}]
-            query = {'$or': or_clause}
-            
-            if not include_locked:
-                query['is_unlocked'] = True
-            
-            results = []
-            for doc in self.capsules.find(query).sort('created_at', -1):
-                item = dict(doc)
-                item['capsule_id'] = item.get('capsule_id')
-                item['_id'] = str(item['_id'])
-                
-                # Convert ObjectId fields
-                if item.get('recipient_id') is not None:
-                    try:
-                        item['recipient_id'] = str(item['recipient_id']) if item['recipient_id'] is not None else None
-                    except Exception:
-                        pass
-                
-                # Convert datetime fields
-                if item.get('unlocked_at'):
-                    item['unlocked_at'] = item['unlocked_at'].isoformat()
-                if item.get('created_at'):
-                    item['created_at'] = item['created_at'].isoformat()
-                if item.get('unlock_date'):
-                    item['unlock_date'] = item['unlock_date'].isoformat()
-                
-                # Build storage info object
-                item['storage_info'] = {
-                    'type': item.get('storage_type', 'cloudinary'),
-                    'public_id': item.get('cloudinary_public_id'),
-                    'url': item.get('cloudinary_url'),
-                    'gridfs_id': None  # GridFS no longer used
-                }
-                
-                # Keep storage fields at top level for easy frontend access
-                # item.pop('cloudinary_public_id', None)  # Keep for frontend
-                # item.pop('cloudinary_url', None)  # Keep for frontend
-                # item.pop('gridfs_id', None)  # Keep for frontend
-                # item.pop('storage_type', None)  # Keep for frontend
-                
-                results.append(item)
-            return results
+            self.capsules.bulk_write(requests, ordered=False)
+        except BulkWriteError as e:
+            # Only the documents that failed lose their uploads
+            failed = {error['index'] for error in e.details.get('writeErrors', [])}
+            self._delete_files_bulk([self._storage_info(docs[index]) for index in failed])
+            logger.error(f"Failed to write {len(failed)} of {len(docs)} capsules in batch: {e}")
+            raise Exception(f"Capsule creation failed: {str(e)}")
+        except Exception as e:
+            logger.error(f"Failed to insert capsule batch: {e}")
+            raise Exception(f"Capsule creation failed: {str(e)}")
+        finally:
+            # Some documents may have been written even if the batch failed
+            for doc in docs:
+                _doc_cache.invalidate(doc['capsule_id'])
+        
+        logger.info(f"Created {len(docs)} capsules in bulk for user {user_id}")
+        
+        return [self._created_result(doc) for doc in docs]
+
+    def _serialize_capsule(self, doc: dict) -> dict:
+        """Convert a capsule document into its JSON-safe API shape.
+        
+        Server-only fields (encryption_iv, inline ciphertext) are never copied.
+        """
+        recipient_id = doc.get('recipient_id')
+        gridfs_id = doc.get('gridfs_id')
+        unlock_date = doc.get('unlock_date')
+        created_at = doc.get('created_at')
+        unlocked_at = doc.get('unlocked_at')
+        return {
+            '_id': str(doc['_id']),
+            'capsule_id': doc.get('capsule_id'),
+            'user_id': doc.get('user_id'),
+            'sender_id': doc.get('sender_id'),
+            'recipient_id': str(recipient_id) if recipient_id is not None else None,
+            'recipient_email': doc.get('recipient_email'),
+            'filename': doc.get('filename'),
+            'capsule_type': doc.get('capsule_type'),
+            'description': doc.get('description'),
+            'original_size': doc.get('original_size'),
+            'unlock_date': _iso(unlock_date) if unlock_date else unlock_date,
+            'created_at': _iso(created_at) if created_at else created_at,
+            'unlocked_at': _iso(unlocked_at) if unlocked_at else unlocked_at,
+            'is_unlocked': doc.get('is_unlocked'),
+            'status': doc.get('status'),
+            # Storage fields stay at top level for easy frontend access
+            'storage_type': doc.get('storage_type'),
+            'cloudinary_public_id': doc.get('cloudinary_public_id'),
+            'cloudinary_url': doc.get('cloudinary_url'),
+            'gridfs_id': str(gridfs_id) if gridfs_id is not None else None,
+            'storage_info': {
+                'type': doc.get('storage_type', 'cloudinary'),
+                'public_id': doc.get('cloudinary_public_id'),
+                'url': doc.get('cloudinary_url'),
+                'gridfs_id': None  # GridFS no longer used
+            }
+        }
+
+    def _user_capsules_query(self, user_id, include_locked: bool = True) -> dict:
+        """Build the query matching capsules sent or received by a user."""
+        # Include both sent and received capsules
+        or_clause = [{'user_id': user_id}, {'recipient_id': user_id}]
+        query = {'$or': or_clause}
+        
+        if not include_locked:
+            query['is_unlocked'] = True
+        
+        return query
+
+    def count_user_capsules(self, user_id, include_locked: bool = True) -> int:
+        """Count capsules for a user without fetching them."""
+        return self.capsules.count_documents(self._user_capsules_query(user_id, include_locked))
+
+    def get_user_capsules(self, user_id, include_locked: bool = True, skip: int = 0, limit: int = 0,
+                          include_names: bool = False) -> list:
+        """Get capsules for a user, newest first.
+        
+        Args:
+            user_id: The user's ID
+            include_locked: Whether to include capsules that are still locked
+            skip: Number of capsules to skip (for pagination)
+            limit: Maximum number of capsules to return (0 means no limit)
+            include_names: Whether to add sender/recipient display names
+        """
+        try:
+            query = self._user_capsules_query(user_id, include_locked)
+            
+            # Ask for the whole page in the first batch; the server default
+            # of 101 documents would otherwise add getMore round trips
+            cursor = self.capsules.find(
+                query, projection=_LISTING_PROJECTION
+            ).sort('created_at', -1).skip(skip).limit(limit).batch_size(limit or _LISTING_BATCH_SIZE)
+            
+            items = [self._serialize_capsule(doc) for doc in cursor]
             
         except Exception as e:
             logger.error(f"Failed to retrieve capsules for user {user_id}: {e}")
             raise Exception(f"Failed to retrieve capsules: {str(e)}")
+        
+        if include_names:
+            self._attach_user_names(items)
+        return items
 
-    def get_capsule_metadata(self, capsule_id: str) -> dict:
-        """Get capsule metadata by ID."""
-        doc = self.capsules.find_one({'capsule_id': capsule_id})
-        if not doc:
-            raise ValueError('Capsule not found')
+    def list_user_capsules_page(self, user_id, cursor: str = None, limit: int = 50,
+                                include_locked: bool = True, include_names: bool = False) -> dict:
+        """Get one page of a user's capsules using keyset pagination.
         
-        item = dict(doc)
-        item['_id'] = str(item['_id'])
+        Unlike skip/limit paging, each page costs the same however deep it
+        is: the cursor encodes the last capsule returned and the query
+        resumes right after it in (created_at, _id) order.
         
-        # Look up sender_name from users collection
-        sender_id = item.get('user_id') or item.get('sender_id')
-        if sender_id:
-            try:
-                from bson import ObjectId
-                sender_doc = self.db.get_collection('users').find_one({'_id': ObjectId(sender_id)})
-                if sender_doc:
-                    item['sender_name'] = sender_doc.get('display_name')
-                    item['sender_email'] = sender_doc.get('email')
-            except Exception:
-                pass
+        Args:
+            user_id: The user's ID
+            cursor: next_cursor from the previous page, or None for the first page
+            limit: Maximum number of capsules to return
+            include_locked: Whether to include capsules that are still locked
+            include_names: Whether to add sender/recipient display names
+            
+        Returns:
+            dict with 'capsules' and 'next_cursor' (None on the last page)
+            
+        Raises:
+            ValueError: If the cursor is malformed
+        """
+        query = self._user_capsules_query(user_id, include_locked)
         
-        # Look up recipient_name from users collection (for owner's view)
-        recipient_id = item.get('recipient_id')
-        if recipient_id:
+        if cursor:
             try:
-                from bson import ObjectId
-                recipient_doc = self.db.get_collection('users').find_one({'_id': ObjectId(recipient_id)})
-                if recipient_doc:
-                    item['recipient_name'] = recipient_doc.get('display_name')
-                    item['recipient_display_email'] = recipient_doc.get('email')
+                created_at, _, last_id = cursor.partition('|')
+                created_at = datetime.fromisoformat(created_at) if created_at else None
+                last_id = ObjectId(last_id)
             except Exception:
-                pass
+                raise ValueError('Invalid cursor')
+            # Legacy capsules without created_at sort after every dated one,
+            # and a cursor ending on one of them carries only the _id
+            if created_at is None:
+                after = {'created_at': None, '_id': {'$lt': last_id}}
+            else:
+                after = {'$or': [
+                    {'created_at': {'$lt': created_at}},
+                    {'created_at': created_at, '_id': {'$lt': last_id}},
+                    {'created_at': None}
+                ]}
+            query = {'$and': [query, after]}
         
-        # Build storage info
-        item['storage_info'] = {
-            'type': item.get('storage_type', 'cloudinary'),
-            'public_id': item.get('cloudinary_public_id'),
-            'url': item.get('cloudinary_url'),
-            'gridfs_id': None  # GridFS no longer used
-        }
+        try:
+            # One extra document tells us whether another page exists
+            docs = list(self.capsules.find(
+                query, projection=_LISTING_PROJECTION
+            ).sort([('created_at', -1), ('_id', -1)]).limit(limit + 1).batch_size(limit + 1))
+        except Exception as e:
+            logger.error(f"Failed to retrieve capsules for user {user_id}: {e}")
+            raise Exception(f"Failed to retrieve capsules: {str(e)}")
         
-        # Convert datetime fields
-        if item.get('unlocked_at'):
-            item['unlocked_at'] = item['unlocked_at'].isoformat()
-        if item.get('created_at'):
-            item['created_at'] = item['created_at'].isoformat()
-        if item.get('unlock_date'):
-            item['unlock_date'] = item['unlock_date'].isoformat()
+        next_cursor = None
+        if len(docs) > limit:
+            docs = docs[:limit]
+            last = docs[-1]
+            last_created_at = last.get('created_at')
+            next_cursor = f"{last_created_at.isoformat() if last_created_at else ''}|{last['_id']}"
         
-        return item
+        items = [self._serialize_capsule(doc) for doc in docs]
+        if include_names:
+            self._attach_user_names(items)
+        
+        return {
+            'capsules': items,
+            'next_cursor': next_cursor
+        }
 
-    def unlock_capsule(self, capsule_id: str) -> dict:
-        """Unlock a capsule and return decrypted content."""
-        doc = self.capsules.find_one({'capsule_id': capsule_id})
+    def get_capsule_metadata(self, capsule_id: str) -> dict:
+        """Get capsule metadata by ID."""
+        doc = self._load_capsule(capsule_id)
         if not doc:
             raise ValueError('Capsule not found')
         
-        # Build storage info for unlock
-        storage_info = {
-            'storage_type': doc.get('storage_type', 'cloudinary'),
-            'public_id': doc.get('cloudinary_public_id'),
-            'gridfs_id': None  # GridFS no longer used
-        }
+        item = self._serialize_capsule(doc)
+        self._attach_user_names([item])
+        return item
+
+    def _attach_user_names(self, items: list):
+        """Add sender/recipient display names and emails to serialized capsules.
         
-        # Read encrypted bytes
-        try:
-            data_bytes = self._retrieve_file(storage_info)
-            encrypted_b64 = base64.b64encode(data_bytes).decode('utf-8')
-            decrypted = self.encryption_service.decrypt_data(encrypted_b64, doc['encryption_iv'])
-        except Exception as e:
-            logger.error(f"[Capsule {capsule_id}] Failed to decrypt: {e}")
-            raise ValueError(f"Failed to decrypt capsule: {str(e)}")
+        All users are resolved with at most one query.
+        """
+        users = self.get_users(
+            [item.get('user_id') or item.get('sender_id') for item in items]
+            + [item.get('recipient_id') for item in items]
+        )
+        
+        for item in items:
+            # Look up sender_name from users collection
+            sender = users.get(item.get('user_id') or item.get('sender_id'))
+            if sender:
+                item['sender_name'] = sender.get('display_name')
+                item['sender_email'] = sender.get('email')
+            
+            # Look up recipient_name from users collection (for owner's view)
+            recipient = users.get(item.get('recipient_id'))
+            if recipient:
+                item['recipient_name'] = recipient.get('display_name')
+                item['recipient_display_email'] = recipient.get('email')
 
-        # Update unlock status
-        if not doc.get('is_unlocked'):
-            self.capsules.update_one(
-                {'_id': doc['_id']}, 
-                {'$set': {'is_unlocked': True, 'unlocked_at': datetime.utcnow()}}
+    def get_users(self, user_ids) -> dict:
+        """Display name and email for each known user, keyed by user ID.
+        
+        Cached users are not queried; the rest are fetched with a single $in.
+        """
+        users = {}
+        uncached = {}
+        for user_id in set(filter(None, user_ids)):
+            user = _user_cache.get(user_id)
+            if user is not None:
+                users[user_id] = user
+            elif ObjectId.is_valid(user_id):
+                uncached[ObjectId(user_id)] = user_id
+        
+        if uncached:
+            try:
+                found = {
+                    doc.pop('_id'): doc
+                    for doc in self.users.find(
+                        {'_id': {'$in': list(uncached)}}, _USER_PROJECTION
+                    )
+                }
+            except Exception:
+                return users
+            
+            # Unknown users are cached as {} so they aren't looked up again
+            for oid, user_id in uncached.items():
+                users[user_id] = found.get(oid, {})
+                _user_cache.set(user_id, users[user_id])
+        
+        return users
+
+    @staticmethod
+    def invalidate_user(user_id: str):
+        """Drop a user's cached display info after their profile changes."""
+        _user_cache.invalidate(str(user_id))
+
+    def unlock_capsule(self, capsule_id: str) -> dict:
+        """Unlock a capsule and return decrypted content."""
+        for _ in range(_UNLOCK_ATTEMPTS):
+            # Lock state is read fresh rather than from the document cache
+            doc = self.capsules.find_one({'capsule_id': capsule_id})
+            if not doc:
+                raise ValueError('Capsule not found')
+            
+            # Decrypt before unlocking, so a fetch or decrypt failure leaves
+            # the capsule locked instead of unlocked with no content
+            try:
+                decrypted = self._decrypt_capsule(doc)
+            except Exception as e:
+                logger.error(f"[Capsule {capsule_id}] Failed to decrypt: {e}")
+                raise ValueError(f"Failed to decrypt capsule: {str(e)}")
+            
+            if doc.get('is_unlocked'):
+                unlocked_at = (doc['unlocked_at'].isoformat() if doc.get('unlocked_at') else None)
+                message = 'Capsule already unlocked'
+                break
+            
+            now = utcnow()
+            
+            # Atomically flip the unlock flag; only one caller can win this.
+            # The IV ties the flip to the content that was just decrypted
+            updated = self.capsules.find_one_and_update(
+                {'capsule_id': capsule_id, 'is_unlocked': {'$ne': True},
+                 'encryption_iv': doc['encryption_iv']},
+                {'$set': {'is_unlocked': True, 'unlocked_at': now}},
+                return_document=ReturnDocument.AFTER
             )
-            unlocked_at = datetime.utcnow().isoformat()
-            message = 'Capsule unlocked successfully'
+            if updated:
+                doc = updated
+                _doc_cache.set(capsule_id, doc)
+                unlocked_at = now.isoformat()
+                message = 'Capsule unlocked successfully'
+                break
+            
+            # Unlocked, edited or deleted since the read; start over
+            _doc_cache.invalidate(capsule_id)
         else:
-            unlocked_at = (doc['unlocked_at'].isoformat() if doc.get('unlocked_at') else None)
-            message = 'Capsule already unlocked'
+            raise ValueError('Capsule changed while unlocking, please try again')
 
         return {
             'capsule_id': capsule_id,
             'filename': doc['filename'],
             'capsule_type': doc['capsule_type'],
-            'data': decrypted.decode('utf-8') if doc['capsule_type'] == 'text' else base64.b64encode(decrypted).decode('utf-8'),
+            'data': self._encode_payload(doc['capsule_type'], decrypted),
             'unlocked_at': unlocked_at,
             'message': message
         }
 
-    def get_decrypted_file_data(self, capsule_id: str, allow_locked_for_owner: bool = False, user_id: str = None) -> tuple:
-        """Get decrypted file data for download."""
-        doc = self.capsules.find_one({'capsule_id': capsule_id})
+    def unlock_capsules(self, capsule_ids: list) -> list:
+        """Unlock capsules in bulk without fetching or decrypting their content.
+        
+        Returns:
+            list: IDs of the capsules this call unlocked; ones that were
+            already unlocked, or unlocked concurrently, are left out
+        """
+        if not capsule_ids:
+            return []
+        
+        # Each flipped capsule is tagged with an ID unique to this call, so
+        # concurrent callers (e.g. one scheduler per worker process) never
+        # both claim it, even when their timestamps collide
+        run_id = ObjectId()
+        query = {'capsule_id': {'$in': list(capsule_ids)}}
+        self.capsules.update_many(
+            {**query, 'is_unlocked': {'$ne': True}},
+            {'$set': {'is_unlocked': True, 'unlocked_at': utcnow(), 'unlock_run': run_id}}
+        )
+        
+        unlocked = [
+            doc['capsule_id']
+            for doc in self.capsules.find({**query, 'unlock_run': run_id}, {'capsule_id': 1})
+        ]
+        for capsule_id in unlocked:
+            _doc_cache.invalidate(capsule_id)
+        return unlocked
+
+    def _decrypt_capsule(self, doc: dict) -> bytes:
+        """Fetch and decrypt a capsule's content, reusing a cached copy when the IV matches."""
+        capsule_id = doc['capsule_id']
+        iv = doc['encryption_iv']
+        
+        # A new IV is generated whenever the content changes, so a matching
+        # IV means the cached plaintext is still current
+        cached = self._plaintext_cache.get(capsule_id)
+        if cached and cached[0] == iv:
+            return cached[1]
+        
+        data_bytes = self._retrieve_file(self._storage_info(doc))
+        decrypted = self._decompress(
+            self.encryption_service.decrypt_raw(data_bytes, iv), doc.get('compression')
+        )
+        self._plaintext_cache.set(capsule_id, (iv, decrypted))
+        return decrypted
+
+    def _encode_payload(self, capsule_type: str, data: bytes) -> str:
+        """Encode decrypted content for a JSON response.
+        
+        Text is returned as-is and never base64 encoded; everything else is
+        base64 encoded straight to a str.
+        """
+        if capsule_type == 'text':
+            return data.decode('utf-8')
+        return b64encode_str(data)
+
+    def _get_downloadable_doc(self, capsule_id: str, allow_locked_for_owner: bool = False, user_id: str = None) -> dict:
+        """Fetch a capsule document and check it may be downloaded."""
+        doc = self._load_capsule(capsule_id)
         if not doc:
             raise ValueError('Capsule not found')
         
@@ -502,35 +1247,49 @@ class CapsuleService:
             else:
                 raise ValueError('Capsule is not unlocked yet')
         
-        # Build storage info for download
-        storage_info = {
-            'storage_type': doc.get('storage_type', 'cloudinary'),
-            'public_id': doc.get('cloudinary_public_id'),
-            'gridfs_id': None  # GridFS no longer used
-        }
+        return doc
+
+    def _get_content_type(self, filename: str) -> str:
+        """Determine the MIME type for a filename."""
+        return _CONTENT_TYPES.get(self._get_extension(filename), 'application/octet-stream')
+
+    def get_decrypted_file_data(self, capsule_id: str, allow_locked_for_owner: bool = False, user_id: str = None) -> tuple:
+        """Get decrypted file data for download."""
+        doc = self._get_downloadable_doc(capsule_id, allow_locked_for_owner, user_id)
         
-        # Read and decrypt
-        data_bytes = self._retrieve_file(storage_info)
-        encrypted_b64 = base64.b64encode(data_bytes).decode('utf-8')
-        decrypted = self.encryption_service.decrypt_data(encrypted_b64, doc['encryption_iv'])
+        decrypted = self._decrypt_capsule(doc)
         
-        # Determine content type
         filename = doc['filename']
-        extension = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
-        content_types = {
-            'txt': 'text/plain', 'pdf': 'application/pdf',
-            'png': 'image/png', 'jpg': 'image/jpeg', 'jpeg': 'image/jpeg', 'gif': 'image/gif',
-            'mp4': 'video/mp4', 'avi': 'video/x-msvideo', 'mov': 'video/quicktime',
-            'mp3': 'audio/mpeg', 'wav': 'audio/wav', 'ogg': 'audio/ogg',
-            'm4a': 'audio/mp4', 'aac': 'audio/aac', 'flac': 'audio/flac'
-        }
-        content_type = content_types.get(extension, 'application/octet-stream')
+        return decrypted, filename, self._get_content_type(filename)
+
+    def iter_decrypted_file_data(self, capsule_id: str, allow_locked_for_owner: bool = False, user_id: str = None) -> tuple:
+        """Get decrypted file data for download as an iterator of chunks.
         
-        return decrypted, filename, content_type
+        The whole file is fetched, decrypted and authenticated before this
+        returns, so a tampered or truncated file raises here instead of
+        after part of it has been sent. The plaintext is spooled to a
+        temporary file rather than held in memory.
+        """
+        doc = self._get_downloadable_doc(capsule_id, allow_locked_for_owner, user_id)
+        
+        cached = self._plaintext_cache.get(capsule_id)
+        if cached and cached[0] == doc['encryption_iv']:
+            chunks = iter((cached[1],))
+        else:
+            storage_info = self._storage_info(doc)
+            chunks = self._spool(self._decompress_stream(
+                self.encryption_service.decrypt_stream(
+                    self._iter_file(storage_info), doc['encryption_iv']
+                ),
+                doc.get('compression')
+            ))
+        
+        filename = doc['filename']
+        return chunks, filename, self._get_content_type(filename)
 
     def get_file_preview_for_edit(self, capsule_id: str, user_id: str) -> dict:
         """Get file data as base64 for preview when editing."""
-        doc = self.capsules.find_one({'capsule_id': capsule_id})
+        doc = self._load_capsule(capsule_id)
         if not doc:
             raise ValueError('Capsule not found')
         
@@ -543,13 +1302,8 @@ class CapsuleService:
             user_id=user_id
         )
         
-        if doc['capsule_type'] == 'text':
-            data_base64 = file_data.decode('utf-8')
-        else:
-            data_base64 = base64.b64encode(file_data).decode('utf-8')
-        
         return {
-            'data': data_base64,
+            'data': self._encode_payload(doc['capsule_type'], file_data),
             'filename': filename,
             'capsule_type': doc['capsule_type'],
             'content_type': content_type
@@ -559,15 +1313,8 @@ class CapsuleService:
                        unlock_date: datetime = None, file_data: bytes = None, 
                        filename: str = None) -> dict:
         """Update capsule metadata and/or file."""
-        doc = self.capsules.find_one({'capsule_id': capsule_id})
-        if not doc:
-            raise ValueError('Capsule not found')
-        
-        if doc['user_id'] != user_id:
-            raise ValueError('Capsule not found')
-        
-        if doc.get('is_unlocked'):
-            raise ValueError('Cannot update unlocked capsule')
+        # Ownership and lock state are part of every write's filter
+        editable = {'capsule_id': capsule_id, 'user_id': user_id, 'is_unlocked': {'$ne': True}}
         
         update_data = {}
         if description is not None:
@@ -578,36 +1325,47 @@ class CapsuleService:
             # Past dates make the capsule immediately unlockable
             update_data['unlock_date'] = unlock_date
         
-        # Handle file replacement
-        if file_data is not None:
-            if filename and not self._allowed_file(filename):
+        old_storage_info = None
+        if file_data is None:
+            if not update_data:
+                raise ValueError('No update data provided')
+            
+            # Metadata-only edits are a single round trip: the previous
+            # version comes back from the write itself
+            doc = self.capsules.find_one_and_update(
+                editable, {'$set': update_data}, return_document=ReturnDocument.BEFORE
+            )
+            if not doc:
+                self._raise_not_editable(capsule_id, user_id)
+            updated = {**doc, **update_data}
+        else:
+            # File replacement needs the current filename and storage first
+            doc = self.capsules.find_one(editable, projection=_REPLACE_PROJECTION)
+            if not doc:
+                self._raise_not_editable(capsule_id, user_id)
+            
+            # Only a new filename can change the extension or the type
+            filename_changed = bool(filename) and filename != doc.get('filename')
+            extension = self._get_extension(filename) if filename_changed else None
+            if filename_changed and extension not in _EXT_TO_TYPE:
                 raise ValueError(f"File type not allowed: {filename}")
             
-            # Delete old file from Cloudinary
-            old_storage_info = {
-                'storage_type': doc.get('storage_type', 'cloudinary'),
-                'public_id': doc.get('cloudinary_public_id'),
-                'gridfs_id': None  # GridFS no longer used
-            }
-            self._delete_file(old_storage_info)
-            
-            # Encrypt new file
-            encrypted_result = self.encryption_service.encrypt_data(file_data)
-            encrypted_b64 = encrypted_result['encrypted_data']
-            iv = encrypted_result['iv']
-            encrypted_bytes = base64.b64decode(encrypted_b64)
-            
-            # Determine file type
-            if filename:
-                extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
-                capsule_type = self._get_file_type(extension)
-            else:
-                capsule_type = doc.get('capsule_type', 'other')
+            old_storage_info = self._storage_info(doc)
+            
+            # Encrypt new file, compressing plain text first
+            original_size = len(file_data)
+            compression = None
+            if self._get_extension(filename or doc.get('filename')) in _COMPRESSIBLE_EXTENSIONS:
+                file_data, compression = self._compress(file_data)
+            encrypted_bytes, iv = self.encryption_service.encrypt_raw(file_data)
             
-            # Store new file in Cloudinary
+            # Store new file in Cloudinary under a fresh public_id, so the old
+            # file stays readable until the metadata points at the new one
             storage_info = self._store_file(encrypted_bytes, capsule_id, 
-                filename or doc.get('filename', 'capsule'))
+                self._get_content_type(filename or doc.get('filename')),
+                name=f"{capsule_id}-{uuid.uuid4().hex}")
             storage_type = storage_info.get('storage_type', 'cloudinary')
+            new_storage_info = {'storage_type': storage_type, 'public_id': storage_info.get('public_id')}
             
             # Update metadata
             update_data['cloudinary_public_id'] = storage_info.get('public_id')
@@ -615,56 +1373,104 @@ class CapsuleService:
             update_data['gridfs_id'] = None  # GridFS no longer used
             update_data['storage_type'] = storage_type
             update_data['encryption_iv'] = iv
-            update_data['original_size'] = len(file_data)
-            if filename:
+            update_data['compression'] = compression
+            update_data['original_size'] = original_size
+            if filename_changed:
                 update_data['filename'] = filename
-                update_data['capsule_type'] = capsule_type
-        
-        if not update_data:
-            raise ValueError('No update data provided')
-        
-        # Store old unlock_date for email notification
-        old_unlock_date = doc.get('unlock_date')
+                update_data['capsule_type'] = _EXT_TO_TYPE[extension]
+            
+            # Replacement files are always uploaded, never kept inline.
+            # The filter is re-checked so a capsule unlocked or reassigned
+            # since the read above is left untouched, as is one whose file
+            # another edit has already replaced
+            try:
+                updated = self.capsules.find_one_and_update(
+                    {**editable, 'cloudinary_public_id': doc.get('cloudinary_public_id')},
+                    {'$set': update_data, '$unset': {'ciphertext': ''}},
+                    return_document=ReturnDocument.AFTER
+                )
+            except Exception:
+                # The metadata may still point at the old file, so the new one goes
+                self._delete_file_later(new_storage_info, capsule_id)
+                raise
+            if not updated:
+                self._delete_file_later(new_storage_info, capsule_id)
+                _doc_cache.invalidate(capsule_id)
+                self._raise_not_editable(capsule_id, user_id)
         
-        self.capsules.update_one(
-            {'capsule_id': capsule_id},
-            {'$set': update_data}
-        )
+        _doc_cache.invalidate(capsule_id)
+        if old_storage_info:
+            self._plaintext_cache.invalidate(capsule_id)
+            # Nothing points at the replaced file any more
+            self._delete_file_later(old_storage_info, capsule_id)
         
-        # Get updated metadata
-        result = self.get_capsule_metadata(capsule_id)
+        # The write returned the updated document, so no re-read is needed
+        result = self._serialize_capsule(updated)
+        self._attach_user_names([result])
         
         # Include old_unlock_date in result for email notification
+        old_unlock_date = doc.get('unlock_date')
         if old_unlock_date:
             result['old_unlock_date'] = old_unlock_date
         
         return result
 
+    def _raise_not_editable(self, capsule_id: str, user_id: str):
+        """Raise the right error for a capsule that didn't match an edit filter."""
+        doc = self.capsules.find_one(
+            {'capsule_id': capsule_id, 'user_id': user_id}, projection={'is_unlocked': 1}
+        )
+        if doc and doc.get('is_unlocked'):
+            raise ValueError('Cannot update unlocked capsule')
+        raise ValueError('Capsule not found')
+
     def delete_capsule(self, capsule_id: str, user_id: str) -> bool:
         """Delete a capsule and its stored file."""
-        doc = self.capsules.find_one({'capsule_id': capsule_id})
+        # Ownership is part of the filter, so the check and the delete are atomic
+        doc = self.capsules.find_one_and_delete(
+            {'capsule_id': capsule_id, 'user_id': user_id}, projection=_STORAGE_PROJECTION
+        )
+        _doc_cache.invalidate(capsule_id)
+        self._plaintext_cache.invalidate(capsule_id)
         if not doc:
             raise ValueError('Capsule not found')
         
-        # Check ownership
-        if doc.get('user_id') != user_id:
-            raise ValueError('Capsule not found')
-        
-        # Delete file from Cloudinary (gracefully handle missing files)
-        storage_info = {
-            'storage_type': doc.get('storage_type', 'cloudinary'),
-            'public_id': doc.get('cloudinary_public_id'),
-            'gridfs_id': None  # GridFS no longer used
-        }
-        try:
-            self._delete_file(storage_info)
-        except Exception as e:
-            logger.warning(f"Could not delete file for capsule {capsule_id}: {e}")
-        
-        # Delete metadata
-        result = self.capsules.delete_one({'capsule_id': capsule_id})
-        if result.deleted_count == 0:
-            raise ValueError('Failed to delete capsule')
+        # The capsule is gone, so its file is removed off the request path
+        self._delete_file_later(self._storage_info(doc), capsule_id)
         
         logger.info(f"Capsule {capsule_id} deleted by user {user_id}")
         return True
+
+    def delete_capsules(self, capsule_ids: list, user_id: str) -> int:
+        """Delete several of a user's capsules and their stored files.
+        
+        Capsules that don't exist or aren't owned by the user are skipped.
+        Metadata is removed with one delete_many; stored files are then
+        deleted concurrently.
+        
+        Args:
+            capsule_ids: IDs of the capsules to delete
+            user_id: The owner's user ID
+            
+        Returns:
+            int: Number of capsules deleted
+        """
+        if not capsule_ids:
+            return 0
+        
+        query = {'capsule_id': {'$in': list(capsule_ids)}, 'user_id': user_id}
+        docs = list(self.capsules.find(query, projection=_STORAGE_PROJECTION))
+        if not docs:
+            return 0
+        
+        result = self.capsules.delete_many(
+            {'capsule_id': {'$in': [doc['capsule_id'] for doc in docs]}, 'user_id': user_id}
+        )
+        for doc in docs:
+            _doc_cache.invalidate(doc['capsule_id'])
+            self._plaintext_cache.invalidate(doc['capsule_id'])
+        
+        self._delete_files_bulk([self._storage_info(doc) for doc in docs])
+        
+        logger.info(f"Deleted {result.deleted_count} capsules for user {user_id}")
+        return result.deleted_count
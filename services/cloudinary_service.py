@@ -5,49 +5,119 @@ This service handles uploading and retrieving encrypted capsule files
 from Cloudinary cloud storage.
 """
 
+import io
 import os
-import base64
 import uuid
 import logging
+import functools
 import cloudinary
 import cloudinary.uploader
 import cloudinary.api
-from datetime import datetime
+import cloudinary.api_client.call_api
+import cloudinary.utils
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from datetime import datetime, timezone
 
 logger = logging.getLogger(__name__)
 
+# Size of each request made by upload_large when streaming a file
+_UPLOAD_CHUNK_SIZE = 20 * 1024 * 1024
+
+# Tags every capsule file is uploaded with, alongside its capsule_id
+_STATIC_TAGS = ('encrypted', 'time_capsule')
+
+# Connections kept open per host, enough for concurrent bulk operations
+_POOL_MAXSIZE = 32
+
+# Shared session for file downloads so TCP/TLS connections to the CDN are
+# reused across requests; idempotent GETs are retried on transient errors
+_DOWNLOAD_TIMEOUT = 60
+_DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+_http = requests.Session()
+_http.mount('https://', HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=_POOL_MAXSIZE,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504))
+))
+
+
+def _pool_sdk_connections():
+    """Widen the keep-alive pools the Cloudinary SDK uses for uploads and Admin API calls.
+    
+    The SDK creates them at import with urllib3's default of one connection
+    per host, so concurrent requests open (and then discard) a fresh TLS
+    connection each. Must run after cloudinary.config() so proxy settings apply.
+    """
+    options = dict(cloudinary.CERT_KWARGS, maxsize=_POOL_MAXSIZE)
+    cloudinary.uploader._http = cloudinary.utils.get_http_connector(cloudinary.config(), options)
+    cloudinary.api_client.call_api._http = cloudinary.utils.get_http_connector(cloudinary.config(), options)
+
+
+class _ChunkStream(io.RawIOBase):
+    """Read-only file object over an iterable of byte chunks of known total size.
+    
+    Seeking only supports what cloudinary.uploader.upload_large needs to
+    measure the stream: jumping to the end and back to the read position.
+    """
+    
+    def __init__(self, chunks, size: int):
+        self._chunks = iter(chunks)
+        self._size = size
+        self._buffer = b''
+        self._read = 0
+        self._pos = 0
+    
+    def readable(self):
+        return True
+    
+    def seekable(self):
+        return True
+    
+    def tell(self):
+        return self._pos
+    
+    def seek(self, offset, whence=io.SEEK_SET):
+        target = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: self._size}[whence] + offset
+        if target not in (self._read, self._size):
+            raise io.UnsupportedOperation("stream can only seek to its end or read position")
+        self._pos = target
+        return target
+    
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._size
+        parts = [self._buffer]
+        available = len(self._buffer)
+        while available < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            parts.append(chunk)
+            available += len(chunk)
+        data = b''.join(parts)
+        data, self._buffer = data[:size], data[size:]
+        self._read += len(data)
+        self._pos = self._read
+        return data
+
 
 class CloudinaryStorageService:
     """Service for storing encrypted capsule files in Cloudinary."""
     
     def __init__(self):
         """Initialize Cloudinary with credentials from environment variables."""
-        import logging
-        import traceback
-        logger = logging.getLogger(__name__)
-        
-        print("\n=== CLOUDINARY INIT DEBUG ===")
-        
         cloud_name = os.getenv('CLOUDINARY_CLOUD_NAME')
         api_key = os.getenv('CLOUDINARY_API_KEY')
         api_secret = os.getenv('CLOUDINARY_API_SECRET')
         
-        print(f"cloud_name: {cloud_name}")
-        print(f"api_key set: {api_key is not None}")
-        print(f"api_secret set: {api_secret is not None}")
-        
         # Validate all credentials
         if not cloud_name:
-            print("❌ ERROR: CLOUDINARY_CLOUD_NAME is empty or not set")
-            print("=== END CLOUDINARY INIT ===\n")
             raise ValueError("CLOUDINARY_CLOUD_NAME is empty or not set")
         if not api_key:
-            print("❌ ERROR: CLOUDINARY_API_KEY is empty or not set")
-            print("=== END CLOUDINARY INIT ===\n")
             raise ValueError("CLOUDINARY_API_KEY is empty or not set")
         if not api_secret:
-            print("❌ ERROR: CLOUDINARY_API_SECRET is empty or not set")
-            print("=== END CLOUDINARY INIT ===\n")
             raise ValueError("CLOUDINARY_API_SECRET is empty or not set")
         
         # Configure Cloudinary
@@ -57,14 +127,29 @@ class CloudinaryStorageService:
             api_secret=api_secret,
             secure=True
         )
+        _pool_sdk_connections()
         
         self.cloud_name = cloud_name
         self.folder = os.getenv('CLOUDINARY_FOLDER', 'time_capsules')
         
-        print(f"✅ SUCCESS: Cloudinary configured: cloud_name={self.cloud_name}, folder={self.folder}")
-        print("=== END CLOUDINARY INIT ===\n")
+        logger.info(f"Cloudinary configured: cloud_name={self.cloud_name}, folder={self.folder}")
     
-    def upload_encrypted_file(self, encrypted_data: bytes, capsule_id: str, content_type: str = 'application/octet-stream') -> dict:
+    def _upload_options(self, public_id: str, capsule_id: str) -> dict:
+        """Upload parameters shared by single-request and chunked uploads."""
+        return {
+            'resource_type': 'raw',
+            'public_id': public_id,
+            'folder': self.folder,
+            'tags': [*_STATIC_TAGS, capsule_id],
+            'context': {
+                'capsule_id': capsule_id,
+                'created_at': datetime.now(timezone.utc).replace(tzinfo=None).isoformat(),
+                'encrypted': 'true'
+            }
+        }
+    
+    def upload_encrypted_file(self, encrypted_data: bytes, capsule_id: str, content_type: str = 'application/octet-stream',
+                              name: str = None) -> dict:
         """
         Upload encrypted file to Cloudinary.
         
@@ -72,36 +157,61 @@ class CloudinaryStorageService:
             encrypted_data: Encrypted file bytes
             capsule_id: Unique capsule identifier
             content_type: MIME type of the original file
+            name: File name within the folder; defaults to capsule_id
             
         Returns:
             dict with upload details including public_id and secure_url
         """
         try:
             # Generate unique public_id for the file
-            public_id = f"{self.folder}/{capsule_id}"
+            public_id = f"{self.folder}/{name or capsule_id}"
             
-            # Convert bytes to base64 string
-            b64_data = base64.b64encode(encrypted_data).decode('utf-8')
+            # Upload the ciphertext as a binary stream; wrapping it in a base64
+            # data URI would build two extra copies ~1.33x the payload size
+            result = cloudinary.uploader.upload(
+                io.BytesIO(encrypted_data),
+                filename=name or capsule_id,
+                **self._upload_options(public_id, capsule_id)
+            )
             
-            # Use data URI format for base64 upload
-            data_uri = f"data:application/octet-stream;base64,{b64_data}"
+            logger.info(f"Uploaded to Cloudinary: {result.get('public_id')}")
             
-            # Upload to Cloudinary using file parameter with data URI
-            result = cloudinary.uploader.upload(
-                data_uri,
-                resource_type='raw',
-                public_id=public_id,
-                folder=self.folder,
-                tags=['encrypted', 'time_capsule', capsule_id],
-                context={
-                    'capsule_id': capsule_id,
-                    'created_at': datetime.utcnow().isoformat(),
-                    'encrypted': 'true'
-                }
+            return {
+                'public_id': result['public_id'],
+                'secure_url': result['secure_url'],
+                'url': result['url'],
+                'resource_type': result['resource_type'],
+                'created_at': result['created_at']
+            }
+            
+        except Exception as e:
+            logger.exception(f"Failed to upload file to Cloudinary: {e}")
+            raise Exception(f"Cloudinary upload failed: {str(e)}")
+    
+    def upload_encrypted_stream(self, chunks, size: int, capsule_id: str) -> dict:
+        """
+        Upload encrypted file chunks to Cloudinary without buffering the whole file.
+        
+        Args:
+            chunks: Iterable of encrypted byte chunks
+            size: Total size of the encrypted data in bytes
+            capsule_id: Unique capsule identifier
+            
+        Returns:
+            dict with upload details including public_id and secure_url
+        """
+        try:
+            public_id = f"{self.folder}/{capsule_id}"
+            
+            # Each part is sent as its own request, so at most one part is in memory
+            result = cloudinary.uploader.upload_large(
+                _ChunkStream(chunks, size),
+                filename=capsule_id,
+                chunk_size=_UPLOAD_CHUNK_SIZE,
+                **self._upload_options(public_id, capsule_id)
             )
             
-            print(f"✅ Uploaded to Cloudinary: {result.get('public_id')}")
-            print(f"URL: {result.get('secure_url')}")
+            logger.info(f"Uploaded stream to Cloudinary: {result.get('public_id')}")
             
             return {
                 'public_id': result['public_id'],
@@ -112,34 +222,70 @@ class CloudinaryStorageService:
             }
             
         except Exception as e:
-            print(f"❌ Failed to upload file to Cloudinary: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.error(f"Failed to upload stream to Cloudinary: {e}")
             raise Exception(f"Cloudinary upload failed: {str(e)}")
     
-    def get_encrypted_file(self, public_id: str) -> bytes:
+    def _delivery_url(self, public_id: str) -> str:
+        """Build a file's delivery URL locally, without an Admin API call.
+        
+        The URL is unversioned, so after a file is overwritten the CDN may
+        briefly serve the old copy; prefer the secure_url saved at upload.
+        """
+        return cloudinary.utils.cloudinary_url(public_id, resource_type='raw', secure=True)[0]
+    
+    def get_encrypted_file(self, public_id: str, url: str = None) -> bytes:
         """
         Retrieve encrypted file from Cloudinary.
         
         Args:
             public_id: The public_id of the file in Cloudinary
+            url: The secure_url returned when the file was uploaded, if known
             
         Returns:
             bytes: The encrypted file data
         """
         try:
-            # Use Cloudinary's built-in download API
-            result = cloudinary.api.resource(public_id, resource_type='raw')
-            url = result['secure_url']
+            response = _http.get(url or self._delivery_url(public_id), timeout=_DOWNLOAD_TIMEOUT)
+            response.raise_for_status()
+            return response.content
             
-            # Download using urllib (built into Python)
-            import urllib.request
-            with urllib.request.urlopen(url) as response:
-                return response.read()
+        except Exception as e:
+            logger.error(f"Failed to retrieve file from Cloudinary: {e}")
+            raise Exception(f"Cloudinary retrieval failed: {str(e)}")
+    
+    def iter_encrypted_file(self, public_id: str, chunk_size: int = _DOWNLOAD_CHUNK_SIZE, url: str = None):
+        """
+        Retrieve encrypted file from Cloudinary chunk by chunk.
+        
+        The request is made before returning, so lookup errors are raised
+        here rather than once iteration has started.
+        
+        Args:
+            public_id: The public_id of the file in Cloudinary
+            chunk_size: Size of each chunk read from the response
+            url: The secure_url returned when the file was uploaded, if known
             
+        Returns:
+            iterator: Chunks of the encrypted file data
+        """
+        try:
+            response = _http.get(
+                url or self._delivery_url(public_id), timeout=_DOWNLOAD_TIMEOUT, stream=True
+            )
+            response.raise_for_status()
         except Exception as e:
             logger.error(f"Failed to retrieve file from Cloudinary: {e}")
             raise Exception(f"Cloudinary retrieval failed: {str(e)}")
+        
+        def generate():
+            with response:
+                try:
+                    yield from response.iter_content(chunk_size)
+                except Exception as e:
+                    logger.error(f"Failed to stream file from Cloudinary: {e}")
+                    raise Exception(f"Cloudinary retrieval failed: {str(e)}")
+        
+        return generate()
     
     def delete_file(self, public_id: str) -> bool:
         """
@@ -159,6 +305,21 @@ class CloudinaryStorageService:
             logger.error(f"Failed to delete file from Cloudinary: {e}")
             return False
     
+    def delete_files(self, public_ids: list) -> list:
+        """
+        Delete up to 100 files from Cloudinary in a single request.
+        
+        Args:
+            public_ids: The public_ids of the files in Cloudinary
+            
+        Returns:
+            list: The public_ids that were deleted
+        """
+        result = cloudinary.api.delete_resources(public_ids, resource_type='raw')
+        deleted = [public_id for public_id, status in result.get('deleted', {}).items() if status == 'deleted']
+        logger.info(f"Deleted {len(deleted)} of {len(public_ids)} files from Cloudinary")
+        return deleted
+    
     def get_file_url(self, public_id: str) -> str:
         """
         Get the URL of a file in Cloudinary.
@@ -169,12 +330,7 @@ class CloudinaryStorageService:
         Returns:
             str: The secure URL of the file
         """
-        try:
-            result = cloudinary.api.resource(public_id, resource_type='raw')
-            return result['secure_url']
-        except Exception as e:
-            logger.error(f"Failed to get file URL from Cloudinary: {e}")
-            raise Exception(f"Failed to get file URL: {str(e)}")
+        return self._delivery_url(public_id)
     
     def file_exists(self, public_id: str) -> bool:
         """
@@ -186,8 +342,18 @@ class CloudinaryStorageService:
         Returns:
             bool: True if the file exists
         """
+        # A HEAD on the delivery URL isn't counted against the Admin API rate limit
         try:
-            cloudinary.api.resource(public_id, resource_type='raw')
-            return True
+            return _http.head(self._delivery_url(public_id), timeout=_DOWNLOAD_TIMEOUT).ok
         except Exception:
             return False
+
+
+@functools.lru_cache(maxsize=1)
+def get_cloudinary_storage() -> CloudinaryStorageService:
+    """Return the process-wide CloudinaryStorageService, creating it on first use.
+    
+    Raises the same errors as CloudinaryStorageService() while Cloudinary is
+    not configured; failures are not cached.
+    """
+    return CloudinaryStorageService()
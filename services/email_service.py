@@ -7,8 +7,13 @@ functionality still works without emails.
 """
 
 import os
+import time
+import functools
 import logging
 import smtplib
+import threading
+from string import Template
+from concurrent.futures import ThreadPoolExecutor
 from email.mime.text import MIMEText
 from email.utils import formataddr
 from datetime import datetime
@@ -16,6 +21,65 @@ from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+# The SMTP connection is kept open between messages, but closed once it has
+# been idle this long; servers commonly drop idle sessions after a minute or so
+_SMTP_IDLE_TIMEOUT = 60
+
+# Socket timeout for SMTP connections, so a stalled server fails the send
+# instead of holding the shared connection indefinitely
+_SMTP_TIMEOUT = 10
+
+# Message bodies, filled in per send with Template.substitute()
+_CREATED_BODY = Template(
+    "Hi $recipient,\n\n"
+    "$sender has created a secret time capsule for you.\n"
+    "It is scheduled to unlock on $unlock_date.\n\n"
+    "You will receive another email when the capsule unlocks.\n\n"
+    "Best regards,\n"
+    "Time Capsule Cloud"
+)
+
+_CREATED_EXTERNAL_BODY = Template(
+    "Hi there,\n\n"
+    "$sender has created a secret time capsule for you using this email address.\n"
+    "It is scheduled to unlock on $unlock_date.\n\n"
+    "To view this capsule when it unlocks, please create an account on Time Capsule Cloud "
+    "using this same email address:\n"
+    "$frontend_url\n\n"
+    "After you sign up and sign in, the capsule will appear in your dashboard when it unlocks.\n\n"
+    "You will also receive another email on the day the capsule unlocks.\n\n"
+    "Best regards,\n"
+    "Time Capsule Cloud"
+)
+
+_UNLOCKED_BODY = Template(
+    "Hi $recipient,\n\n"
+    "The time capsule from $sender has just unlocked ($unlock_date).\n"
+    "Log in to Time Capsule Cloud to view your secret message or file.\n\n"
+    "Best regards,\n"
+    "Time Capsule Cloud"
+)
+
+_DATE_UPDATED_BODY = Template(
+    "Hi $recipient\n\n"
+    "The unlock date for your time capsule from $sender has been updated.\n\n"
+    "Old unlock date: $old_unlock_date\n"
+    "New unlock date: $new_unlock_date\n\n"
+    "The capsule will now unlock on the new date.\n\n"
+    "Best regards,\n"
+    "Time Capsule Cloud"
+)
+
+_PASSWORD_RESET_BODY = Template(
+    "Hi $recipient,\n\n"
+    "You requested to reset your password for Time Capsule Cloud.\n\n"
+    "Click the link below to reset your password:\n$reset_url\n\n"
+    "This link will expire in 1 hour.\n\n"
+    "If you didn't request this, please ignore this email.\n\n"
+    "Best regards,\n"
+    "Time Capsule Cloud"
+)
+
 
 class EmailService:
     """Service responsible for sending email notifications."""
@@ -30,6 +94,12 @@ class EmailService:
         self.use_ssl = os.getenv("SMTP_USE_SSL", "0") == "1" or self.port == 465
         # If host or from_email is missing, treat email as disabled
         self.enabled = bool(self.host and self.from_email)
+        
+        self._conn = None
+        self._conn_used_at = 0.0
+        self._lock = threading.Lock()
+        # Threads are only started on first submit, so this is cheap to create
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='email')
 
         if not self.enabled:
             logger.warning("EmailService disabled: SMTP_HOST or EMAIL_FROM not set")
@@ -59,24 +129,8 @@ class EmailService:
             msg["From"] = formataddr((self.from_name, self.from_email))
             msg["To"] = to_email
 
-            # Choose SSL or STARTTLS based on configuration
-            if self.use_ssl:
-                smtp_class = smtplib.SMTP_SSL
-            else:
-                smtp_class = smtplib.SMTP
-
-            with smtp_class(self.host, self.port) as server:
-                server.ehlo()
-                # Use STARTTLS only in non-SSL mode when username/password provided
-                if not self.use_ssl and self.username and self.password:
-                    try:
-                        server.starttls()
-                        server.ehlo()
-                    except smtplib.SMTPException:
-                        logger.warning("SMTP server does not support STARTTLS; continuing without it")
-                if self.username and self.password:
-                    server.login(self.username, self.password)
-                server.send_message(msg)
+            with self._lock:
+                self._deliver(msg)
 
             logger.info("Sent email to %s with subject '%s'", to_email, subject)
         except Exception as exc:  # pragma: no cover - defensive logging
@@ -84,6 +138,81 @@ class EmailService:
             # Re-raise so that debug/test endpoints can surface the error
             raise
 
+    def _deliver(self, msg):
+        """Send a message over the shared connection, reconnecting if it was dropped.
+        
+        Must be called with self._lock held.
+        """
+        if self._conn is not None and time.monotonic() - self._conn_used_at > _SMTP_IDLE_TIMEOUT:
+            self._close_connection()
+        
+        for attempt in range(2):
+            if self._conn is None:
+                self._conn = self._connect()
+            try:
+                self._conn.send_message(msg)
+                break
+            except (smtplib.SMTPServerDisconnected, ConnectionError):
+                # The server closed the session since it was last used
+                self._close_connection()
+                if attempt:
+                    raise
+        
+        self._conn_used_at = time.monotonic()
+
+    def _connect(self):
+        """Open and authenticate a new SMTP connection."""
+        # Choose SSL or STARTTLS based on configuration
+        if self.use_ssl:
+            smtp_class = smtplib.SMTP_SSL
+        else:
+            smtp_class = smtplib.SMTP
+
+        server = smtp_class(self.host, self.port, timeout=_SMTP_TIMEOUT)
+        try:
+            server.ehlo()
+            # Use STARTTLS only in non-SSL mode when username/password provided
+            if not self.use_ssl and self.username and self.password:
+                try:
+                    server.starttls()
+                    server.ehlo()
+                except smtplib.SMTPException:
+                    logger.warning("SMTP server does not support STARTTLS; continuing without it")
+            if self.username and self.password:
+                server.login(self.username, self.password)
+        except Exception:
+            server.close()
+            raise
+        return server
+
+    def _close_connection(self):
+        """Close the shared connection, ignoring errors from an already-dead socket."""
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            try:
+                conn.quit()
+            except Exception:
+                conn.close()
+
+    def close(self):
+        """Close the SMTP connection kept open between messages."""
+        with self._lock:
+            self._close_connection()
+
+    def send_in_background(self, send, *args, **kwargs):
+        """Run one of the send_* helpers on a background thread.
+        
+        Messages are sent one at a time, in the order they were queued, over
+        the shared connection. Failures are logged instead of raised.
+        """
+        def run():
+            try:
+                send(*args, **kwargs)
+            except Exception:
+                logger.exception("Background email failed")
+
+        self._executor.submit(run)
+
     # Public helpers for specific notification types
 
     def send_capsule_created_notification(
@@ -100,13 +229,10 @@ class EmailService:
         display_recipient = recipient_name or "there"
         display_sender = sender_name or "someone"
         subject = "A time capsule has been created for you"
-        body = (
-            f"Hi {display_recipient},\n\n"
-            f"{display_sender} has created a secret time capsule for you.\n"
-            f"It is scheduled to unlock on {unlock_date.strftime('%Y-%m-%d %H:%M UTC')}.\n\n"
-            "You will receive another email when the capsule unlocks.\n\n"
-            "Best regards,\n"
-            "Time Capsule Cloud"
+        body = _CREATED_BODY.substitute(
+            recipient=display_recipient,
+            sender=display_sender,
+            unlock_date=unlock_date.strftime('%Y-%m-%d %H:%M UTC'),
         )
         self._send(recipient_email, subject, body)
 
@@ -125,17 +251,10 @@ class EmailService:
         display_sender = sender_name or "someone"
         frontend_url = os.getenv("FRONTEND_URL", "http://localhost:3000")
         subject = "A time capsule has been created for you"
-        body = (
-            "Hi there,\n\n"
-            f"{display_sender} has created a secret time capsule for you using this email address.\n"
-            f"It is scheduled to unlock on {unlock_date.strftime('%Y-%m-%d %H:%M UTC')}.\n\n"
-            "To view this capsule when it unlocks, please create an account on Time Capsule Cloud "
-            "using this same email address:\n"
-            f"{frontend_url}\n\n"
-            "After you sign up and sign in, the capsule will appear in your dashboard when it unlocks.\n\n"
-            "You will also receive another email on the day the capsule unlocks.\n\n"
-            "Best regards,\n"
-            "Time Capsule Cloud"
+        body = _CREATED_EXTERNAL_BODY.substitute(
+            sender=display_sender,
+            unlock_date=unlock_date.strftime('%Y-%m-%d %H:%M UTC'),
+            frontend_url=frontend_url,
         )
         self._send(recipient_email, subject, body)
 
@@ -155,12 +274,10 @@ class EmailService:
         date_text = (
             unlock_date.strftime("%Y-%m-%d %H:%M UTC") if unlock_date else "now"
         )
-        body = (
-            f"Hi {display_recipient},\n\n"
-            f"The time capsule from {display_sender} has just unlocked ({date_text}).\n"
-            "Log in to Time Capsule Cloud to view your secret message or file.\n\n"
-            "Best regards,\n"
-            "Time Capsule Cloud"
+        body = _UNLOCKED_BODY.substitute(
+            recipient=display_recipient,
+            sender=display_sender,
+            unlock_date=date_text,
         )
         self._send(recipient_email, subject, body)
 
@@ -183,14 +300,11 @@ class EmailService:
         new_date_str = new_unlock_date.strftime('%Y-%m-%d at %H:%M UTC')
         
         subject = "Your time capsule unlock date has been updated"
-        body = (
-            f"Hi {display_recipient}\n\n"
-            f"The unlock date for your time capsule from {display_sender} has been updated.\n\n"
-            f"Old unlock date: {old_date_str}\n"
-            f"New unlock date: {new_date_str}\n\n"
-            "The capsule will now unlock on the new date.\n\n"
-            "Best regards,\n"
-            "Time Capsule Cloud"
+        body = _DATE_UPDATED_BODY.substitute(
+            recipient=display_recipient,
+            sender=display_sender,
+            old_unlock_date=old_date_str,
+            new_unlock_date=new_date_str,
         )
         self._send(recipient_email, subject, body)
 
@@ -208,13 +322,18 @@ class EmailService:
         # For now, we'll include instructions
         reset_url = f"{os.getenv('FRONTEND_URL', 'http://localhost:3000')}/reset-password?token={reset_token}"
         subject = "Password Reset Request"
-        body = (
-            f"Hi {display_recipient},\n\n"
-            "You requested to reset your password for Time Capsule Cloud.\n\n"
-            f"Click the link below to reset your password:\n{reset_url}\n\n"
-            "This link will expire in 1 hour.\n\n"
-            "If you didn't request this, please ignore this email.\n\n"
-            "Best regards,\n"
-            "Time Capsule Cloud"
+        body = _PASSWORD_RESET_BODY.substitute(
+            recipient=display_recipient,
+            reset_url=reset_url,
         )
-        self._send(recipient_email, subject, body)
\ No newline at end of file
+        self._send(recipient_email, subject, body)
+
+
+@functools.lru_cache(maxsize=1)
+def get_email_service() -> EmailService:
+    """Return the process-wide EmailService, creating it on first use.
+    
+    Sharing one instance means one SMTP connection and one background
+    sender per process.
+    """
+    return EmailService()
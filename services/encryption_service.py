@@ -2,14 +2,49 @@
 Encryption Service for Time Capsule Cloud
 
 This module handles AES-256 encryption and decryption of capsule data
-using PyCryptodome for secure storage.
+using the OpenSSL-backed `cryptography` package for secure storage.
+
+New data is encrypted with AES-256-GCM under a 12-byte nonce, with the
+16-byte tag appended to the ciphertext. Data written before that used
+AES-256-CBC with PKCS#7 padding under a 16-byte IV; both are decrypted,
+told apart by the length of the stored IV.
 """
 
 import os
-import base64
-from Crypto.Cipher import AES
-from Crypto.Random import get_random_bytes
-from Crypto.Util.Padding import pad, unpad
+try:
+    # SIMD-accelerated drop-in replacement for the stdlib codec
+    import pybase64 as base64
+except ImportError:
+    import base64
+import hmac
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from utils.helpers import b64encode_str, lazy_pool
+
+_BLOCK_SIZE = 16
+_NONCE_SIZE = 12
+_TAG_SIZE = 16
+
+# Files are read, and decrypted files written, in chunks of this size
+_FILE_CHUNK_SIZE = 1024 * 1024
+
+# CBC decryption of each block only depends on the previous ciphertext block,
+# so large payloads are split into segments and decrypted on a shared pool
+_PARALLEL_DECRYPT_THRESHOLD = 4 * 1024 * 1024
+_DECRYPT_SEGMENT_SIZE = 1024 * 1024
+
+# Shared by all EncryptionService instances
+_get_decrypt_pool = lazy_pool(os.cpu_count(), 'decrypt')
+
+
+def _unpad(data):
+    """Strip and check PKCS#7 padding, comparing the pad bytes in constant time."""
+    pad_len = data[-1] if data else 0
+    expected = bytes((pad_len,)) * pad_len
+    if not 1 <= pad_len <= _BLOCK_SIZE or not hmac.compare_digest(data[-pad_len:], expected):
+        raise ValueError("Padding is incorrect.")
+    return data[:-pad_len]
+
 
 class EncryptionService:
     """Service for handling encryption and decryption of capsule data."""
@@ -17,6 +52,10 @@ class EncryptionService:
     def __init__(self):
         """Initialize the encryption service with the encryption key."""
         self.key = self._get_encryption_key()
+        # Built once and shared by every cipher; AESGCM also keeps its
+        # expanded key between calls
+        self._aes = algorithms.AES(self.key)
+        self._aead = AESGCM(self.key)
     
     def _get_encryption_key(self):
         """Get the encryption key from environment variables."""
@@ -37,71 +76,212 @@ class EncryptionService:
         
         return key.encode('utf-8')
     
-    def encrypt_data(self, data):
+    def _cipher(self, iv):
+        """AES-256-CBC cipher for the given raw IV (legacy data only)."""
+        return Cipher(self._aes, modes.CBC(bytes(iv)))
+    
+    def _gcm_cipher(self, nonce):
+        """AES-256-GCM cipher for incremental encryption or decryption."""
+        return Cipher(self._aes, modes.GCM(nonce))
+    
+    def encrypt_raw(self, data):
         """
-        Encrypt data using AES-256 in CBC mode.
+        Encrypt data using AES-256 in GCM mode without base64-wrapping the ciphertext.
         
         Args:
             data (bytes): The data to encrypt
             
         Returns:
-            dict: Dictionary containing encrypted data and initialization vector
+            tuple: (encrypted_bytes, iv) where iv is the base64 encoded nonce
         """
         try:
-            # Generate a random initialization vector
-            iv = get_random_bytes(16)
-            
-            # Create cipher object
-            cipher = AES.new(self.key, AES.MODE_CBC, iv)
-            
-            # Pad the data to block size
-            padded_data = pad(data, AES.block_size)
-            
-            # Encrypt the data
-            encrypted_data = cipher.encrypt(padded_data)
-            
-            # Encode to base64 for storage
-            encrypted_b64 = base64.b64encode(encrypted_data).decode('utf-8')
-            iv_b64 = base64.b64encode(iv).decode('utf-8')
-            
-            return {
-                'encrypted_data': encrypted_b64,
-                'iv': iv_b64
-            }
+            nonce = os.urandom(_NONCE_SIZE)
+            encrypted_data = self._aead.encrypt(nonce, data, None)
+            return encrypted_data, b64encode_str(nonce)
             
         except Exception as e:
             raise Exception(f"Encryption failed: {str(e)}")
     
-    def decrypt_data(self, encrypted_data, iv):
+    def decrypt_raw(self, encrypted_data, iv):
         """
-        Decrypt data using AES-256 in CBC mode.
+        Decrypt raw ciphertext bytes using AES-256 in GCM or (legacy) CBC mode.
         
         Args:
-            encrypted_data (str): Base64 encoded encrypted data
-            iv (str): Base64 encoded initialization vector
+            encrypted_data (bytes): Encrypted data as raw bytes
+            iv (str): Base64 encoded nonce or initialization vector
             
         Returns:
             bytes: The decrypted data
         """
         try:
-            # Decode from base64
-            encrypted_bytes = base64.b64decode(encrypted_data)
             iv_bytes = base64.b64decode(iv)
             
-            # Create cipher object
-            cipher = AES.new(self.key, AES.MODE_CBC, iv_bytes)
+            if len(iv_bytes) == _NONCE_SIZE:
+                # Raises InvalidTag if the ciphertext was modified
+                return self._aead.decrypt(iv_bytes, bytes(encrypted_data), None)
             
-            # Decrypt the data
-            decrypted_padded = cipher.decrypt(encrypted_bytes)
+            if len(encrypted_data) >= _PARALLEL_DECRYPT_THRESHOLD and (os.cpu_count() or 1) > 1:
+                decrypted_padded = self._decrypt_parallel(encrypted_data, iv_bytes)
+            else:
+                decryptor = self._cipher(iv_bytes).decryptor()
+                decrypted_padded = decryptor.update(encrypted_data) + decryptor.finalize()
             
             # Remove padding
-            decrypted_data = unpad(decrypted_padded, AES.block_size)
+            return _unpad(decrypted_padded)
             
-            return decrypted_data
+        except Exception as e:
+            raise Exception(f"Decryption failed: {str(e) or type(e).__name__}")
+    
+    def _decrypt_parallel(self, encrypted_data, iv_bytes):
+        """Decrypt legacy CBC ciphertext in independent segments on the shared pool."""
+        if len(encrypted_data) % _BLOCK_SIZE:
+            raise ValueError("Ciphertext length is not a multiple of the block size")
+        
+        view = memoryview(encrypted_data)
+        
+        def decrypt_segment(start):
+            # Each segment's IV is the ciphertext block just before it
+            segment_iv = iv_bytes if start == 0 else view[start - _BLOCK_SIZE:start]
+            return self._cipher(segment_iv).decryptor().update(view[start:start + _DECRYPT_SEGMENT_SIZE])
+        
+        offsets = range(0, len(encrypted_data), _DECRYPT_SEGMENT_SIZE)
+        return b''.join(_get_decrypt_pool().map(decrypt_segment, offsets))
+    
+    def encrypt_stream(self, chunks):
+        """
+        Incrementally encrypt an iterable of plaintext chunks.
+        
+        The nonce is generated up front so it can be stored before the
+        ciphertext has been consumed. The output is identical to
+        encrypt_raw's: the authentication tag follows the last chunk.
+        
+        Args:
+            chunks (iterable): Iterable of plaintext byte chunks
             
+        Returns:
+            tuple: (ciphertext_chunks, iv) where ciphertext_chunks is a
+                generator of encrypted bytes and iv is the base64 encoded nonce
+        """
+        nonce = os.urandom(_NONCE_SIZE)
+        encryptor = self._gcm_cipher(nonce).encryptor()
+        
+        def generate():
+            for chunk in chunks:
+                encrypted = encryptor.update(chunk)
+                if encrypted:
+                    yield encrypted
+            yield encryptor.finalize() + encryptor.tag
+        
+        return generate(), b64encode_str(nonce)
+    
+    @staticmethod
+    def encrypted_size(size):
+        """Size of the ciphertext produced for `size` bytes of plaintext."""
+        return size + _TAG_SIZE
+    
+    def decrypt_stream(self, chunks, iv):
+        """
+        Incrementally decrypt an iterable of raw ciphertext chunks.
+        
+        Chunks may be any size. For GCM data the tag is only checked once
+        the input is exhausted, so a modified ciphertext raises after its
+        plaintext has been yielded; output must not reach a client until
+        the stream has been consumed without error. For legacy CBC data the
+        final block is held back so the padding can be removed.
+        
+        Args:
+            chunks (iterable): Iterable of encrypted byte chunks
+            iv (str): Base64 encoded nonce or initialization vector
+            
+        Yields:
+            bytes: Decrypted data chunks
+        """
+        try:
+            iv_bytes = base64.b64decode(iv)
+            if len(iv_bytes) == _NONCE_SIZE:
+                decryptor = self._gcm_cipher(iv_bytes).decryptor()
+            else:
+                decryptor = self._cipher(iv_bytes).decryptor()
+        except Exception as e:
+            raise Exception(f"Decryption failed: {str(e)}")
+        
+        if len(iv_bytes) == _NONCE_SIZE:
+            yield from self._decrypt_gcm_stream(chunks, decryptor)
+            return
+        
+        # The decryptor buffers partial blocks; the last plaintext block is
+        # always held back so the padding can be removed at the end
+        held = b''
+        for chunk in chunks:
+            decrypted = decryptor.update(chunk)
+            if decrypted:
+                if held:
+                    yield held
+                held = decrypted[-_BLOCK_SIZE:]
+                if len(decrypted) > _BLOCK_SIZE:
+                    yield decrypted[:-_BLOCK_SIZE]
+        
+        try:
+            yield _unpad(held + decryptor.finalize())
         except Exception as e:
             raise Exception(f"Decryption failed: {str(e)}")
     
+    def _decrypt_gcm_stream(self, chunks, decryptor):
+        """Decrypt GCM chunks, holding back the trailing tag until the end."""
+        tail = b''
+        for chunk in chunks:
+            data = tail + chunk if tail else chunk
+            if len(data) <= _TAG_SIZE:
+                tail = bytes(data)
+                continue
+            tail = bytes(data[-_TAG_SIZE:])
+            yield decryptor.update(memoryview(data)[:-_TAG_SIZE])
+        
+        try:
+            if len(tail) < _TAG_SIZE:
+                raise ValueError("Ciphertext is too short")
+            final = decryptor.finalize_with_tag(tail)
+        except Exception as e:
+            raise Exception(f"Decryption failed: {str(e) or type(e).__name__}")
+        if final:
+            yield final
+    
+    def encrypt_data(self, data):
+        """
+        Encrypt data using AES-256 in GCM mode.
+        
+        Args:
+            data (bytes): The data to encrypt
+            
+        Returns:
+            dict: Dictionary containing encrypted data and initialization vector
+        """
+        encrypted_data, iv_b64 = self.encrypt_raw(data)
+        
+        # Encode to base64 for storage
+        return {
+            'encrypted_data': b64encode_str(encrypted_data),
+            'iv': iv_b64
+        }
+    
+    def decrypt_data(self, encrypted_data, iv):
+        """
+        Decrypt data using AES-256 in GCM or (legacy) CBC mode.
+        
+        Args:
+            encrypted_data (str): Base64 encoded encrypted data
+            iv (str): Base64 encoded nonce or initialization vector
+            
+        Returns:
+            bytes: The decrypted data
+        """
+        try:
+            encrypted_bytes = base64.b64decode(encrypted_data)
+        except Exception as e:
+            raise Exception(f"Decryption failed: {str(e)}")
+        
+        return self.decrypt_raw(encrypted_bytes, iv)
+    
     def encrypt_file(self, file_path):
         """
         Encrypt a file and return the encrypted data.
@@ -113,15 +293,18 @@ class EncryptionService:
             dict: Dictionary containing encrypted file data and metadata
         """
         try:
+            # The plaintext is read and encrypted a chunk at a time, so only
+            # the ciphertext is ever held in full
             with open(file_path, 'rb') as file:
-                file_data = file.read()
-            
-            encrypted_result = self.encrypt_data(file_data)
+                encrypted_chunks, iv = self.encrypt_stream(
+                    iter(lambda: file.read(_FILE_CHUNK_SIZE), b'')
+                )
+                encrypted_data = b''.join(encrypted_chunks)
             
             return {
-                'encrypted_data': encrypted_result['encrypted_data'],
-                'iv': encrypted_result['iv'],
-                'original_size': len(file_data)
+                'encrypted_data': b64encode_str(encrypted_data),
+                'iv': iv,
+                'original_size': len(encrypted_data) - _TAG_SIZE
             }
             
         except Exception as e:
@@ -133,17 +316,26 @@ class EncryptionService:
         
         Args:
             encrypted_data (str): Base64 encoded encrypted data
-            iv (str): Base64 encoded initialization vector
+            iv (str): Base64 encoded nonce or initialization vector
             output_path (str): Path where decrypted file should be saved
             
         Returns:
             str: Path to the decrypted file
         """
         try:
-            decrypted_data = self.decrypt_data(encrypted_data, iv)
+            view = memoryview(base64.b64decode(encrypted_data))
+            chunks = (view[i:i + _FILE_CHUNK_SIZE] for i in range(0, len(view), _FILE_CHUNK_SIZE))
             
-            with open(output_path, 'wb') as file:
-                file.write(decrypted_data)
+            # Plaintext is written as it is decrypted; a file that fails
+            # authentication at the end is removed rather than left behind
+            try:
+                with open(output_path, 'wb') as file:
+                    for chunk in self.decrypt_stream(chunks, iv):
+                        file.write(chunk)
+            except Exception:
+                if os.path.exists(output_path):
+                    os.unlink(output_path)
+                raise
             
             return output_path
             
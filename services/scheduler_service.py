@@ -8,14 +8,39 @@ This service runs inside Flask application context to ensure proper
 access to database connections and email services.
 """
 
+import socket
 import logging
-from datetime import datetime
+from datetime import timedelta
+from itertools import islice
+from apscheduler.executors.pool import ThreadPoolExecutor
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
-from bson import ObjectId
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from utils.helpers import utcnow
 
 logger = logging.getLogger(__name__)
 
+# Fields read from each capsule due for unlock; inline ciphertext and the
+# rest of the document are left on the server
+_DUE_CAPSULE_PROJECTION = {
+    'capsule_id': 1, 'recipient_email': 1, 'recipient_id': 1,
+    'sender_id': 1, 'user_id': 1, 'unlock_date': 1, '_id': 0,
+}
+
+# Due capsules are processed in batches whose senders and recipients are
+# looked up together, rather than with two queries per capsule
+_DUE_BATCH_SIZE = 100
+
+# Every app process runs its own scheduler; the first to claim an hour's
+# lease runs that hour's check. Leases outlive the hour so a late process
+# can't claim it, then are removed by the TTL index on expires_at
+_LEASE_TTL = timedelta(hours=2)
+
+# A run that is still going when the next one is due is not overlapped, runs
+# missed while the process was busy collapse into one, and a run may start
+# up to five minutes late rather than being dropped (the default is 1s)
+_JOB_DEFAULTS = {'coalesce': True, 'max_instances': 1, 'misfire_grace_time': 300}
+
 
 class SchedulerService:
     """
@@ -35,15 +60,21 @@ class SchedulerService:
         Args:
             db: MongoDB database instance
             capsule_service: CapsuleService instance
-            email_service: EmailService instance (optional, will create if not provided)
+            email_service: EmailService instance (optional; unlock emails are skipped without one)
             app: Flask application instance (required for app context)
         """
         self.db = db
         self.capsules = db.get_collection('capsules')
+        self.notifications = db.get_collection('notifications')
+        self.scheduler_locks = db.get_collection('scheduler_locks')
         self.capsule_service = capsule_service
         self.email_service = email_service
         self.app = app
-        self.scheduler = BackgroundScheduler()
+        # There is a single job that never overlaps itself, so one worker thread
+        self.scheduler = BackgroundScheduler(
+            executors={'default': ThreadPoolExecutor(1)},
+            job_defaults=_JOB_DEFAULTS,
+        )
         self.is_running = False
         
         # Validate Flask app is provided
@@ -55,8 +86,7 @@ class SchedulerService:
         Start the background scheduler for capsule unlock checks.
         
         Schedule:
-        - Hourly check: Every hour at minute 0
-        - Daily check: Every day at midnight (00:00)
+        - Hourly check: Every hour at minute 0, which includes midnight
         """
         if not self.is_running:
             # Add hourly job - runs at the start of every hour
@@ -68,18 +98,9 @@ class SchedulerService:
                 replace_existing=True,
             )
             
-            # Add daily job - runs at midnight every day
-            self.scheduler.add_job(
-                func=self._run_daily_check,
-                trigger=CronTrigger(hour=0, minute=0),
-                id='daily_capsule_check',
-                name='Daily Capsule Unlock Check',
-                replace_existing=True,
-            )
-            
             self.scheduler.start()
             self.is_running = True
-            logger.info('Scheduler started successfully - jobs scheduled for hourly and daily checks')
+            logger.info('Scheduler started successfully - hourly unlock check scheduled')
     
     def stop_scheduler(self):
         """Stop the background scheduler."""
@@ -88,50 +109,63 @@ class SchedulerService:
             self.is_running = False
             logger.info('Scheduler stopped')
     
-    def _run_hourly_check(self):
+    def _acquire_lease(self, name: str) -> bool:
         """
-        Hourly check wrapper that runs inside Flask app context.
+        Claim this hour's lease for a job across all app processes.
         
-        This wrapper ensures that all operations have access to Flask context.
+        Args:
+            name: Job name the lease is taken for
+            
+        Returns:
+            bool: True if this process holds the lease and should run the job
         """
-        if self.app:
-            with self.app.app_context():
-                self.check_and_unlock_capsules(hourly=True)
-        else:
-            # Fallback if no Flask app - run directly (may have issues)
-            logger.warning("Running scheduler without Flask app context")
-            self.check_and_unlock_capsules(hourly=True)
+        now = utcnow()
+        try:
+            self.scheduler_locks.insert_one({
+                '_id': f"{name}-{now:%Y%m%d%H}",
+                'owner': socket.gethostname(),
+                'acquired_at': now,
+                'expires_at': now + _LEASE_TTL,
+            })
+            return True
+        except DuplicateKeyError:
+            return False
     
-    def _run_daily_check(self):
+    def _run_hourly_check(self):
         """
-        Daily check wrapper that runs inside Flask app context.
+        Hourly check wrapper that runs inside Flask app context.
         
         This wrapper ensures that all operations have access to Flask context.
         """
+        try:
+            if not self._acquire_lease('unlock-check'):
+                logger.info("[Unlock Check] Skipped: already running in another process this hour")
+                return
+        except Exception as e:
+            # Better to risk a duplicate scan than to skip unlocks entirely
+            logger.warning(f"[Unlock Check] Could not take scheduler lease: {str(e)}")
+        
         if self.app:
             with self.app.app_context():
-                self.check_and_unlock_capsules(hourly=False)
+                self.check_and_unlock_capsules()
         else:
             # Fallback if no Flask app - run directly (may have issues)
             logger.warning("Running scheduler without Flask app context")
-            self.check_and_unlock_capsules(hourly=False)
+            self.check_and_unlock_capsules()
     
-    def check_and_unlock_capsules(self, hourly: bool = False):
+    def check_and_unlock_capsules(self):
         """
         Main job that finds and unlocks capsules that are ready.
         
         This method:
         1. Queries MongoDB for capsules with unlock_date <= now and is_unlocked = False
-        2. Unlocks each capsule via capsule_service
+        2. Unlocks them in batches via capsule_service
         3. Creates in-app notifications
         4. Sends email notifications to recipients
-        
-        Args:
-            hourly: Whether this is an hourly check (for logging purposes)
         """
         try:
-            current_time = datetime.utcnow()
-            logger.info(f"[{'Hourly' if hourly else 'Daily'} Check] Scanning for capsules ready to unlock at {current_time.isoformat()}")
+            current_time = utcnow()
+            logger.info(f"[Unlock Check] Scanning for capsules ready to unlock at {current_time.isoformat()}")
             
             # Query: capsules that are NOT unlocked AND have unlock_date <= now
             query = {
@@ -139,57 +173,73 @@ class SchedulerService:
                 'unlock_date': {'$lte': current_time}
             }
             
-            cursor = self.capsules.find(query)
+            # Each server batch fills exactly one processing batch
+            cursor = self.capsules.find(
+                query, projection=_DUE_CAPSULE_PROJECTION, batch_size=_DUE_BATCH_SIZE
+            )
             count = 0
             unlock_count = 0
             email_count = 0
             
-            for doc in cursor:
-                count += 1
-                capsule_id = doc.get('capsule_id')
-                recipient_email = doc.get('recipient_email')
-                recipient_id = doc.get('recipient_id')
-                sender_id = doc.get('sender_id') or doc.get('user_id')
+            while batch := list(islice(cursor, _DUE_BATCH_SIZE)):
+                users = self.capsule_service.get_users(
+                    str(user_id)
+                    for doc in batch
+                    for user_id in (doc.get('recipient_id'), doc.get('sender_id') or doc.get('user_id'))
+                    if user_id
+                )
+                count += len(batch)
                 
+                # Step 1: Unlock the batch; capsules unlocked concurrently by
+                # another run are skipped so they aren't notified twice
                 try:
-                    # Step 1: Unlock the capsule
-                    self.capsule_service.unlock_capsule(capsule_id)
-                    unlock_count += 1
-                    logger.info(f"[Capsule {capsule_id}] Successfully unlocked")
-                    
-                    # Step 2: Create in-app notification
-                    self._create_notification(doc, capsule_id, recipient_id, sender_id)
-                    
-                    # Step 3: Send email notification
-                    email_sent = self._send_unlock_email(doc, capsule_id, recipient_id, sender_id, recipient_email)
-                    if email_sent:
-                        email_count += 1
-                        
+                    unlocked = set(self.capsule_service.unlock_capsules(
+                        [doc.get('capsule_id') for doc in batch]
+                    ))
                 except Exception as e:
-                    logger.error(f"[Capsule {capsule_id}] Failed to process: {str(e)}")
+                    logger.error(f"Failed to unlock batch of {len(batch)} capsules: {str(e)}")
                     continue
+                unlocked_docs = [doc for doc in batch if doc.get('capsule_id') in unlocked]
+                unlock_count += len(unlocked_docs)
+                
+                # Step 2: Create in-app notifications
+                self._create_notifications(unlocked_docs, current_time)
+                
+                # Step 3: Send email notifications
+                for doc in unlocked_docs:
+                    capsule_id = doc.get('capsule_id')
+                    recipient_id = doc.get('recipient_id')
+                    sender_id = doc.get('sender_id') or doc.get('user_id')
+                    email_sent = self._send_unlock_email(
+                        doc, capsule_id, recipient_id, sender_id, doc.get('recipient_email'), users
+                    )
+                    if email_sent:
+                        email_count += 1
             
             logger.info(
-                f"[{'Hourly' if hourly else 'Daily'} Check] Complete. "
+                "[Unlock Check] Complete. "
                 f"Found {count} capsules, unlocked {unlock_count}, emails sent: {email_count}"
             )
             
         except Exception as e:
-            logger.error(f"[{'Hourly' if hourly else 'Daily'} Check] Critical error: {str(e)}")
+            logger.error(f"[Unlock Check] Critical error: {str(e)}")
             raise
     
-    def _create_notification(self, doc, capsule_id, recipient_id, sender_id):
+    def _create_notifications(self, docs, now):
         """
-        Create an in-app notification for the capsule recipient.
+        Create in-app notifications for the recipients of unlocked capsules.
+        
+        All notifications are written with a single unordered insert_many,
+        so one failed insert doesn't stop the rest.
         
         Args:
-            doc: Capsule document from MongoDB
-            capsule_id: The capsule ID
-            recipient_id: Recipient user ID
-            sender_id: Sender user ID
+            docs: Capsule documents from MongoDB
+            now: Time of the unlock check, used as every notification's created_at
         """
-        try:
-            notifications = self.db.get_collection('notifications')
+        notifications = []
+        for doc in docs:
+            recipient_id = doc.get('recipient_id')
+            sender_id = doc.get('sender_id') or doc.get('user_id')
             
             # Determine notification message
             notification_message = 'You received a capsule released today'
@@ -199,21 +249,27 @@ class SchedulerService:
             
             # Only create notification for registered users
             if recipient_id:
-                notifications.insert_one({
+                notifications.append({
                     'user_id': recipient_id,
                     'type': 'capsule_release',
-                    'capsule_id': capsule_id,
+                    'capsule_id': doc.get('capsule_id'),
                     'sender_id': sender_id,
-                    'created_at': datetime.utcnow(),
+                    'created_at': now,
                     'read': False,
                     'message': notification_message
                 })
-                logger.info(f"[Notification] Created for user {recipient_id}")
-                
+        
+        if not notifications:
+            return
+        try:
+            self.notifications.insert_many(notifications, ordered=False)
+            logger.info(f"[Notification] Created {len(notifications)} notifications")
+        except BulkWriteError as e:
+            logger.error(f"[Notification] Failed to create some notifications: {e.details.get('writeErrors')}")
         except Exception as e:
             logger.error(f"[Notification] Failed to create: {str(e)}")
     
-    def _send_unlock_email(self, doc, capsule_id, recipient_id, sender_id, recipient_email) -> bool:
+    def _send_unlock_email(self, doc, capsule_id, recipient_id, sender_id, recipient_email, users) -> bool:
         """
         Send unlock notification email to the recipient.
         
@@ -223,13 +279,12 @@ class SchedulerService:
             recipient_id: Recipient user ID
             sender_id: Sender user ID
             recipient_email: External recipient email (if any)
+            users: Display name and email of the batch's users, keyed by user ID
             
         Returns:
             bool: True if email was sent successfully, False otherwise
         """
         try:
-            users = self.db.get_collection('users')
-            
             # Determine recipient email and name
             target_email = None
             target_name = None
@@ -238,36 +293,19 @@ class SchedulerService:
             # First priority: external recipient email (non-registered user)
             if recipient_email:
                 target_email = recipient_email
-                logger.info(f"[Email] Sending to external recipient: {target_email}")
+                logger.info("[Email] Sending to external recipient: %s", target_email)
             
             # Second priority: look up registered user
             elif recipient_id:
-                # Handle ObjectId conversion
-                if isinstance(recipient_id, str):
-                    try:
-                        recipient_obj_id = ObjectId(recipient_id)
-                        recipient_doc = users.find_one({'_id': recipient_obj_id})
-                    except Exception:
-                        recipient_doc = None
-                else:
-                    recipient_doc = users.find_one({'_id': recipient_id})
-                
+                recipient_doc = users.get(str(recipient_id))
                 if recipient_doc:
                     target_email = recipient_doc.get('email')
                     target_name = recipient_doc.get('display_name')
-                    logger.info(f"[Email] Sending to registered user: {target_name} ({target_email})")
+                    logger.info("[Email] Sending to registered user: %s (%s)", target_name, target_email)
             
             # Get sender name
             if sender_id:
-                if isinstance(sender_id, str):
-                    try:
-                        sender_obj_id = ObjectId(sender_id)
-                        sender_doc = users.find_one({'_id': sender_obj_id})
-                    except Exception:
-                        sender_doc = None
-                else:
-                    sender_doc = users.find_one({'_id': sender_id})
-                
+                sender_doc = users.get(str(sender_id))
                 if sender_doc:
                     sender_name = sender_doc.get('display_name')
             
@@ -280,17 +318,17 @@ class SchedulerService:
                     sender_name=sender_name,
                     unlock_date=unlock_date,
                 )
-                logger.info(f"[Email] Successfully sent unlock notification to {target_email}")
+                logger.info("[Email] Successfully sent unlock notification to %s", target_email)
                 return True
             elif not target_email:
-                logger.warning(f"[Email] No recipient email found for capsule {capsule_id}")
+                logger.warning("[Email] No recipient email found for capsule %s", capsule_id)
                 return False
             else:
-                logger.warning(f"[Email] Email service not configured")
+                logger.warning("[Email] Email service not configured")
                 return False
                 
         except Exception as e:
-            logger.error(f"[Email] Failed to send unlock notification: {str(e)}")
+            logger.error("[Email] Failed to send unlock notification: %s", e)
             return False
     
     def force_unlock_capsule(self, capsule_id: str):
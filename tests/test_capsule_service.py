@@ -3,12 +3,36 @@ Unit tests for CapsuleService (MongoDB + GridFS)
 """
 
 import pytest
-from unittest.mock import Mock
+from unittest.mock import ANY, Mock
 from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+import services.capsule_service as capsule_service
 from services.capsule_service import CapsuleService
 from services.encryption_service import EncryptionService
 
 
+def _make_service(monkeypatch):
+    """Build a CapsuleService over a Mock database with Mock Cloudinary storage."""
+    monkeypatch.setenv('ENCRYPTION_KEY', 'test-key-32-characters-long-1234')
+    monkeypatch.setattr(capsule_service, 'GridFSBucket', Mock())
+    db = Mock()
+    svc = CapsuleService(db, EncryptionService())
+    svc.cloudinary_storage = Mock()
+    return svc
+
+
+def _mock_cursor(docs):
+    """A find() cursor whose chained sort/limit/batch_size return itself."""
+    cursor = Mock()
+    cursor.sort.return_value = cursor
+    cursor.limit.return_value = cursor
+    cursor.batch_size.return_value = cursor
+    cursor.__iter__ = lambda self: iter(docs)
+    return cursor
+
+
 class TestCapsuleService:
     def setup_method(self):
         self.mock_db = Mock()
@@ -41,3 +65,202 @@ class TestCapsuleService:
         future = datetime.utcnow() + timedelta(days=1)
         with pytest.raises(ValueError):
             self.svc.create_capsule('u1', b'data', 'bad.exe', future)
+
+
+class TestListUserCapsulesPage:
+    """Keyset pagination of a user's capsules."""
+    
+    @pytest.fixture(autouse=True)
+    def setup(self, monkeypatch):
+        self.svc = _make_service(monkeypatch)
+        self.capsules = self.svc.capsules
+    
+    def _doc(self, created_at=None):
+        doc = {'_id': ObjectId(), 'capsule_id': str(ObjectId()), 'user_id': 'u1'}
+        if created_at:
+            doc['created_at'] = created_at
+        return doc
+    
+    def _query(self):
+        return self.capsules.find.call_args[0][0]
+    
+    def test_next_cursor_when_more_pages(self):
+        created = datetime(2024, 1, 1)
+        docs = [self._doc(created), self._doc(created), self._doc(created)]
+        self.capsules.find.return_value = cursor = _mock_cursor(docs)
+        
+        page = self.svc.list_user_capsules_page('u1', limit=2)
+        
+        assert len(page['capsules']) == 2
+        assert page['next_cursor'] == f"{created.isoformat()}|{docs[1]['_id']}"
+        cursor.sort.assert_called_once_with([('created_at', -1), ('_id', -1)])
+        cursor.limit.assert_called_once_with(3)
+    
+    def test_last_page_has_no_cursor(self):
+        self.capsules.find.return_value = _mock_cursor([self._doc(datetime(2024, 1, 1))])
+        
+        page = self.svc.list_user_capsules_page('u1', limit=2)
+        
+        assert len(page['capsules']) == 1
+        assert page['next_cursor'] is None
+    
+    def test_cursor_breaks_ties_on_id(self):
+        created = datetime(2024, 1, 1)
+        last_id = ObjectId()
+        self.capsules.find.return_value = _mock_cursor([])
+        
+        self.svc.list_user_capsules_page('u1', cursor=f"{created.isoformat()}|{last_id}")
+        
+        after = self._query()['$and'][1]['$or']
+        assert {'created_at': {'$lt': created}} in after
+        assert {'created_at': created, '_id': {'$lt': last_id}} in after
+        # Undated legacy capsules sort after every dated one
+        assert {'created_at': None} in after
+    
+    def test_undated_last_capsule_gets_id_only_cursor(self):
+        docs = [self._doc(datetime(2024, 1, 1)), self._doc(), self._doc()]
+        self.capsules.find.return_value = _mock_cursor(docs)
+        
+        page = self.svc.list_user_capsules_page('u1', limit=2)
+        assert page['next_cursor'] == f"|{docs[1]['_id']}"
+        
+        self.capsules.find.return_value = _mock_cursor([])
+        self.svc.list_user_capsules_page('u1', cursor=page['next_cursor'])
+        assert self._query()['$and'][1] == {'created_at': None, '_id': {'$lt': docs[1]['_id']}}
+    
+    @pytest.mark.parametrize('cursor', ['garbage', 'not-a-date|507f1f77bcf86cd799439011', '2024-01-01T00:00:00|nope'])
+    def test_malformed_cursor(self, cursor):
+        with pytest.raises(ValueError, match='Invalid cursor'):
+            self.svc.list_user_capsules_page('u1', cursor=cursor)
+        self.capsules.find.assert_not_called()
+
+
+class TestBulkCapsules:
+    """Bulk creation and deletion, and cleanup of their stored files."""
+    
+    @pytest.fixture(autouse=True)
+    def setup(self, monkeypatch):
+        self.svc = _make_service(monkeypatch)
+        self.capsules = self.svc.capsules
+        self.storage = self.svc.cloudinary_storage
+        self.storage.upload_encrypted_file.side_effect = self._upload
+        self.storage.delete_files.side_effect = lambda public_ids: list(public_ids)
+        self.unlock_date = datetime.utcnow() + timedelta(days=1)
+    
+    @staticmethod
+    def _upload(data, capsule_id, content_type, name=None):
+        return {'public_id': f"capsules/{capsule_id}", 'secure_url': f"https://cdn/{capsule_id}"}
+    
+    def _specs(self, count):
+        return [
+            {'unlock_date': self.unlock_date, 'recipient_id': 'r1',
+             'file_data': b'\x89PNG' * 64, 'filename': f"photo{i}.png"}
+            for i in range(count)
+        ]
+    
+    def test_create_bulk_writes_one_batch_of_upserts(self):
+        results = self.svc.create_capsules_bulk('u1', self._specs(3))
+        
+        assert [r['message'] for r in results] == ['Capsule created successfully'] * 3
+        self.capsules.bulk_write.assert_called_once()
+        requests = self.capsules.bulk_write.call_args[0][0]
+        assert requests == [
+            UpdateOne({'capsule_id': r['capsule_id']}, {'$setOnInsert': ANY}, upsert=True)
+            for r in results
+        ]
+        assert self.capsules.bulk_write.call_args[1] == {'ordered': False}
+        self.storage.delete_files.assert_not_called()
+    
+    def test_create_bulk_partial_write_failure_removes_only_failed_uploads(self):
+        self.capsules.bulk_write.side_effect = BulkWriteError(
+            {'writeErrors': [{'index': 1, 'errmsg': 'boom'}]}
+        )
+        
+        with pytest.raises(Exception, match='Capsule creation failed'):
+            self.svc.create_capsules_bulk('u1', self._specs(3))
+        
+        requests = self.capsules.bulk_write.call_args[0][0]
+        failed_id = requests[1]._filter['capsule_id']
+        self.storage.delete_files.assert_called_once_with([f"capsules/{failed_id}"])
+    
+    def test_create_bulk_upload_failure_removes_other_uploads(self):
+        def upload(data, capsule_id, content_type, name=None):
+            if self.storage.upload_encrypted_file.call_count == 2:
+                raise RuntimeError('upload failed')
+            return self._upload(data, capsule_id, content_type)
+        self.storage.upload_encrypted_file.side_effect = upload
+        
+        with pytest.raises(ValueError, match='Failed to create capsules'):
+            self.svc.create_capsules_bulk('u1', self._specs(3), max_workers=1)
+        
+        self.capsules.bulk_write.assert_not_called()
+        deleted = self.storage.delete_files.call_args[0][0]
+        assert len(deleted) == 2
+    
+    def test_delete_many_batches_cloudinary_deletes(self):
+        docs = [
+            {'capsule_id': f"c{i}", 'storage_type': 'cloudinary', 'cloudinary_public_id': f"capsules/c{i}"}
+            for i in range(250)
+        ]
+        self.capsules.find.return_value = docs
+        self.capsules.delete_many.return_value = Mock(deleted_count=250)
+        
+        assert self.svc.delete_capsules([doc['capsule_id'] for doc in docs], 'u1') == 250
+        
+        batches = [call[0][0] for call in self.storage.delete_files.call_args_list]
+        assert sorted(map(len, batches)) == [50, 100, 100]
+        assert sorted(sum(batches, [])) == sorted(doc['cloudinary_public_id'] for doc in docs)
+        self.capsules.delete_many.assert_called_once()
+    
+    def test_delete_many_falls_back_to_single_deletes(self):
+        docs = [
+            {'capsule_id': f"c{i}", 'storage_type': 'cloudinary', 'cloudinary_public_id': f"capsules/c{i}"}
+            for i in range(3)
+        ]
+        self.capsules.find.return_value = docs
+        self.capsules.delete_many.return_value = Mock(deleted_count=3)
+        self.storage.delete_files.side_effect = RuntimeError('rate limited')
+        self.storage.delete_file.return_value = True
+        
+        assert self.svc.delete_capsules(['c0', 'c1', 'c2'], 'u1') == 3
+        
+        assert self.storage.delete_file.call_count == 3
+
+
+class TestUnlockCapsule:
+    """Unlocking decrypts first and only then flips the lock flag."""
+    
+    @pytest.fixture(autouse=True)
+    def setup(self, monkeypatch):
+        self.svc = _make_service(monkeypatch)
+        self.capsules = self.svc.capsules
+        ciphertext, iv = self.svc.encryption_service.encrypt_raw(b'sealed note')
+        self.doc = {
+            'capsule_id': str(ObjectId()), 'filename': 'note.txt', 'capsule_type': 'text',
+            'storage_type': 'inline', 'ciphertext': ciphertext, 'encryption_iv': iv,
+            'is_unlocked': False,
+        }
+        self.capsules.find_one.return_value = self.doc
+    
+    def test_unlock_success(self):
+        self.capsules.find_one_and_update.return_value = {**self.doc, 'is_unlocked': True}
+        
+        result = self.svc.unlock_capsule(self.doc['capsule_id'])
+        
+        assert result['data'] == 'sealed note'
+        assert result['message'] == 'Capsule unlocked successfully'
+    
+    def test_decrypt_failure_leaves_capsule_locked(self):
+        self.doc['ciphertext'] = b'\x00' * len(self.doc['ciphertext'])
+        
+        with pytest.raises(ValueError, match='Failed to decrypt capsule'):
+            self.svc.unlock_capsule(self.doc['capsule_id'])
+        self.capsules.find_one_and_update.assert_not_called()
+    
+    def test_retries_are_bounded(self):
+        # The gated write never matches, as if the capsule kept being edited
+        self.capsules.find_one_and_update.return_value = None
+        
+        with pytest.raises(ValueError, match='Capsule changed while unlocking'):
+            self.svc.unlock_capsule(self.doc['capsule_id'])
+        assert self.capsules.find_one_and_update.call_count == capsule_service._UNLOCK_ATTEMPTS
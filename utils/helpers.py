@@ -0,0 +1,44 @@
+"""
+Small helpers shared by the services of Time Capsule Cloud
+"""
+
+import binascii
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+try:
+    # SIMD-accelerated drop-in replacement for the stdlib codec
+    import pybase64 as base64
+except ImportError:
+    import base64
+
+# pybase64 can encode straight to str without an intermediate bytes object;
+# binascii skips the stdlib wrapper's extra checks and copies
+b64encode_str = getattr(
+    base64, 'b64encode_as_string',
+    lambda data: binascii.b2a_base64(data, newline=False).decode('ascii')
+)
+
+
+def utcnow() -> datetime:
+    """Current UTC time as a naive datetime, matching what is stored in MongoDB."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def lazy_pool(max_workers: int, thread_name_prefix: str):
+    """Return a function that creates a shared thread pool on its first call."""
+    pool = None
+    lock = threading.Lock()
+    
+    def get():
+        nonlocal pool
+        if pool is None:
+            with lock:
+                if pool is None:
+                    pool = ThreadPoolExecutor(
+                        max_workers=max_workers, thread_name_prefix=thread_name_prefix
+                    )
+        return pool
+    
+    return get
@@ -0,0 +1,42 @@
+"""
+JSON response serialization for Time Capsule Cloud
+
+Serializes jsonify() responses with orjson when it is installed, keeping
+the output of Flask's default provider (sorted keys, HTTP-date datetimes).
+"""
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    # Datetimes are passed through to Flask's default() so they keep the
+    # HTTP-date format the API has always returned
+    _ORJSON_OPTIONS = (
+        orjson.OPT_SORT_KEYS
+        | orjson.OPT_NON_STR_KEYS
+        | orjson.OPT_PASSTHROUGH_DATETIME
+        | orjson.OPT_APPEND_NEWLINE
+    )
+
+
+class ORJSONProvider(DefaultJSONProvider):
+    """JSON provider that uses orjson for compact responses.
+
+    Falls back to the default provider when orjson is not installed, for
+    indented (debug) output, and for values orjson cannot encode.
+    """
+
+    def response(self, *args, **kwargs):
+        if orjson is None or (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)
+
+        obj = self._prepare_response_obj(args, kwargs)
+        try:
+            body = orjson.dumps(obj, default=self.default, option=_ORJSON_OPTIONS)
+        except TypeError:
+            return super().response(*args, **kwargs)
+        return self._app.response_class(body, mimetype=self.mimetype)
@@ -3,7 +3,34 @@ Input validation utilities for Time Capsule Cloud
 """
 
 import re
-from datetime import datetime
+import sys
+import string
+from datetime import datetime, timedelta, timezone
+
+# Patterns are compiled once at import
+_EMAIL_RE = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+_UPPER_RE = re.compile(r'[A-Z]')
+_LOWER_RE = re.compile(r'[a-z]')
+_DIGIT_RE = re.compile(r'\d')
+
+# Characters allowed in display names: ASCII letters and digits, '.', '_',
+# '-', and whitespace (every character str.isspace() accepts, which is what
+# \s matched when this was a regex). A set test runs faster than a regex
+_DISPLAY_NAME_CHARS = frozenset(
+    string.ascii_letters + string.digits + '._-'
+    + '\t\n\x0b\x0c\r\x1c\x1d\x1e\x1f \x85\xa0\u1680\u2000\u2001\u2002\u2003\u2004'
+    '\u2005\u2006\u2007\u2008\u2009\u200a\u2028\u2029\u202f\u205f\u3000'
+)
+
+# Python 3.11+ parses a trailing 'Z' itself; older versions need it spelled out
+if sys.version_info >= (3, 11):
+    _parse_iso = datetime.fromisoformat
+else:
+    def _parse_iso(date_str):
+        return datetime.fromisoformat(date_str.replace('Z', '+00:00'))
+
+# Furthest ahead an unlock date may be: 100 years, counting leap days
+_MAX_UNLOCK_AHEAD = timedelta(days=36525)
 
 
 def validate_email(email: str) -> tuple[bool, str]:
@@ -21,14 +48,17 @@ def validate_email(email: str) -> tuple[bool, str]:
     
     email = email.strip().lower()
     
-    # Basic email regex
-    pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
+    # Cheap checks first, so oversized or obviously malformed input never
+    # reaches the regex
+    if len(email) > 254:  # RFC 5321 limit
+        return False, "Email address too long"
     
-    if not re.match(pattern, email):
+    if not 0 < email.find('@') < len(email) - 1:
         return False, "Invalid email format"
     
-    if len(email) > 254:  # RFC 5321 limit
-        return False, "Email address too long"
+    # Basic email regex
+    if not _EMAIL_RE.match(email):
+        return False, "Invalid email format"
     
     return True, ""
 
@@ -58,13 +88,13 @@ def validate_password(password: str) -> tuple[bool, str]:
     if len(password) > 128:
         return False, "Password is too long (maximum 128 characters)"
     
-    if not re.search(r'[A-Z]', password):
+    if not _UPPER_RE.search(password):
         return False, "Password must contain at least one uppercase letter"
     
-    if not re.search(r'[a-z]', password):
+    if not _LOWER_RE.search(password):
         return False, "Password must contain at least one lowercase letter"
     
-    if not re.search(r'\d', password):
+    if not _DIGIT_RE.search(password):
         return False, "Password must contain at least one number"
     
     return True, ""
@@ -85,18 +115,22 @@ def validate_unlock_date(date_str: str) -> tuple[bool, str, datetime | None]:
     
     try:
         # Parse ISO format
-        unlock_date = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
-    except ValueError:
+        unlock_date = _parse_iso(date_str)
+    except (TypeError, ValueError):
         return False, "Invalid date format. Use ISO 8601 format (YYYY-MM-DDTHH:MM:SSZ)", None
     
-    current_time = datetime.utcnow()
+    # Read the clock once, matching the parsed date's awareness so a
+    # trailing 'Z' doesn't make the comparison fail
+    current_time = datetime.now(timezone.utc)
+    if unlock_date.tzinfo is None:
+        current_time = current_time.replace(tzinfo=None)
     
     if unlock_date <= current_time:
         return False, "Unlock date must be in the future", None
     
-    # Prevent dates too far in the future (optional: 100 years)
-    max_future = datetime.utcnow().replace(year=datetime.utcnow().year + 100)
-    if unlock_date > max_future:
+    # Prevent dates too far in the future (optional: 100 years). A timedelta
+    # avoids replace(year=...), which raises on 29 February
+    if unlock_date - current_time > _MAX_UNLOCK_AHEAD:
         return False, "Unlock date cannot be more than 100 years in the future", None
     
     return True, "", unlock_date
@@ -127,7 +161,7 @@ def validate_display_name(display_name: str) -> tuple[bool, str]:
         return False, "Display name must be 100 characters or less"
     
     # Allow letters, numbers, spaces, and common special characters
-    if not re.match(r'^[a-zA-Z0-9\s._-]+$', display_name):
+    if not _DISPLAY_NAME_CHARS.issuperset(display_name):
         return False, "Display name contains invalid characters"
     
     return True, ""